@@ -6,13 +6,18 @@ import datetime
 import random
 import uuid
 import asyncio
+import bisect
 import logging
 import traceback
 import math
+import time
 import contextlib
+import functools
 import os
 import glob
-from typing import Optional, List, Dict
+import pathlib
+from typing import Optional, List, Dict, FrozenSet
+from collections import defaultdict, Counter
 from dotenv import load_dotenv
 from logging.handlers import RotatingFileHandler
 
@@ -64,361 +69,700 @@ class Color:
 
 # ── 設定管理・権限チェックシステム ──
 
+# 権限レベルの強さ（小さいほど偉い）
+LEVEL_RANK = {"SUPREME_GOD": 0, "GODDESS": 1, "ADMIN": 2}
+UNKNOWN_LEVEL_RANK = len(LEVEL_RANK)  # 未知のレベル（どの管理ロールでも満たせる）
+
 class ConfigManager:
     def __init__(self, bot):
         self.bot = bot
         self.vc_reward_per_min: int = 10
         self.role_wages: Dict[int, int] = {}       
         self.admin_roles: Dict[int, str] = {}      
+        self.admin_role_ranks: Dict[int, int] = {}  # {role_id: 強さ(小さいほど偉い)}
+        # 一時VCのプラン価格 {"6": 価格, "12": 価格, "24": 価格}
+        self.vc_prices: Dict[str, int] = dict(self.VC_PRICE_DEFAULTS)
+        self.public_vc_prices: Dict[str, int] = dict(self.PUBLIC_VC_PRICE_DEFAULTS)
+        self.public_vc_exclude_role_ids: FrozenSet[int] = frozenset()  # 公開VCに入れないロール
+        self.log_channel_ids: Dict[str, int] = {}        # {"currency_log_id": channel_id, ...}
+
+    VC_PRICE_DEFAULTS = {"6": 30000, "12": 50000, "24": 80000}
+    PUBLIC_VC_PRICE_DEFAULTS = {"6": 10000, "12": 30000, "24": 50000}
 
     async def reload(self):
+        # 3つの設定表を1回のクエリで読み、出どころ(src)で振り分ける
         async with self.bot.get_db() as db:
-            async with db.execute("SELECT value FROM server_config WHERE key = 'vc_reward'") as cursor:
-                row = await cursor.fetchone()
-                if row: self.vc_reward_per_min = int(row['value'])
-            
-            async with db.execute("SELECT role_id, amount FROM role_wages") as cursor:
-                rows = await cursor.fetchall()
-                self.role_wages = {r['role_id']: r['amount'] for r in rows}
+            rows = await db.execute_fetchall("""
+                SELECT 'cfg' AS src, key AS k, value AS v FROM server_config
+                 WHERE key IN ('vc_reward', 'public_vc_exclude_roles')
+                    OR key LIKE 'vc_price_%' OR key LIKE 'public_vc_price_%' OR key GLOB '*_log_id'
+                UNION ALL SELECT 'wage', role_id, amount FROM role_wages
+                UNION ALL SELECT 'adm', role_id, perm_level FROM admin_roles
+            """)
 
-            async with db.execute("SELECT role_id, perm_level FROM admin_roles") as cursor:
-                rows = await cursor.fetchall()
-                self.admin_roles = {r['role_id']: r['perm_level'] for r in rows}
+        role_wages: Dict[int, int] = {}
+        admin_roles: Dict[int, str] = {}
+        vc_prices = dict(self.VC_PRICE_DEFAULTS)
+        public_vc_prices = dict(self.PUBLIC_VC_PRICE_DEFAULTS)
+        exclude_role_ids: FrozenSet[int] = frozenset()
+        log_channel_ids: Dict[str, int] = {}
+        for r in rows:
+            if r['src'] == 'wage':
+                role_wages[r['k']] = r['v']
+            elif r['src'] == 'adm':
+                admin_roles[r['k']] = r['v']
+            elif r['k'] == 'vc_reward':
+                self.vc_reward_per_min = int(r['v'])
+            elif r['k'] == 'public_vc_exclude_roles':
+                # CSVはここで一度だけ分解しておく
+                exclude_role_ids = frozenset(int(x) for x in (r['v'] or '').split(',') if x)
+            elif r['k'].endswith('_log_id'):
+                log_channel_ids[r['k']] = int(r['v'])
+            elif r['k'].startswith('public_vc_price_'):
+                public_vc_prices[r['k'][len('public_vc_price_'):]] = int(r['v'])
+            else:
+                vc_prices[r['k'][len('vc_price_'):]] = int(r['v'])
+        self.role_wages = role_wages
+        self.admin_roles = admin_roles
+        self.vc_prices = vc_prices
+        self.public_vc_prices = public_vc_prices
+        self.public_vc_exclude_role_ids = exclude_role_ids
+        self.log_channel_ids = log_channel_ids
+
+        # 権限チェック用に、レベル名を強さの数値へ変換しておく（未知のレベルは除外）
+        self.admin_role_ranks = {
+            r_id: LEVEL_RANK[lvl] for r_id, lvl in self.admin_roles.items() if lvl in LEVEL_RANK
+        }
+        # 管理ロール設定が変わった可能性があるので、権限判定のキャッシュは捨てる
+        self.bot._perm_cache.clear()
         logger.info("Configuration and Permissions reloaded.")
 
+# 権限判定の結果キャッシュ {(user_id, required_level, roles_hash): (許可, 期限)}
+# ロール構成が変われば roles_hash も変わるので、古い判定が使われることはない
+PERM_CACHE_TTL = 60.0
+PERM_CACHE_MAX = 4096
+
 def has_permission(required_level: str):
     async def predicate(interaction: discord.Interaction) -> bool:
-        if await interaction.client.is_owner(interaction.user):
-            return True
-        
-        user_role_ids = [role.id for role in interaction.user.roles]
-        admin_roles = interaction.client.config.admin_roles
-        
-        # 権限レベルの強さ定義
-        levels = ["SUPREME_GOD", "GODDESS", "ADMIN"]
-        try:
-            req_index = levels.index(required_level)
-        except ValueError:
-            req_index = len(levels) # 未知のレベル
-
-        for r_id in user_role_ids:
-            if r_id in admin_roles:
-                user_level = admin_roles[r_id]
-                try:
-                    user_index = levels.index(user_level)
-                    if user_index <= req_index: # インデックスが小さいほど偉い
-                        return True
-                except ValueError:
-                    continue
-        
-        raise app_commands.AppCommandError(f"この操作には '{required_level}' 以上の権限が必要です。")
-    return app_commands.check(predicate)
-
-class BankDatabase:
-    def __init__(self, db_path="stella_bank_v1.db"):
-        self.db_path = db_path
-
-    async def setup(self, conn):
-        # 高速化設定
-        await conn.execute("PRAGMA journal_mode=WAL")
-        await conn.execute("PRAGMA synchronous=NORMAL")
-        await conn.execute("PRAGMA foreign_keys = ON") 
-
-        # 1. 口座・取引
-        await conn.execute("""CREATE TABLE IF NOT EXISTS accounts (
-            user_id INTEGER PRIMARY KEY,
-            balance INTEGER DEFAULT 0 CHECK(balance >= 0), 
-            total_earned INTEGER DEFAULT 0
-        )""")
-        await conn.execute("INSERT OR IGNORE INTO accounts (user_id, balance, total_earned) VALUES (0, 0, 0)")
-        # ▲▲▲ ここまで ▲▲▲
-
-        await conn.execute("""CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_id INTEGER REFERENCES accounts(user_id),
-            receiver_id INTEGER REFERENCES accounts(user_id),
-            amount INTEGER,
-            type TEXT,
-            batch_id TEXT,
-            month_tag TEXT,
-            description TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        # 2. 設定・権限
-        await conn.execute("CREATE TABLE IF NOT EXISTS server_config (key TEXT PRIMARY KEY, value TEXT)")
-        await conn.execute("CREATE TABLE IF NOT EXISTS role_wages (role_id INTEGER PRIMARY KEY, amount INTEGER NOT NULL)")
-        await conn.execute("CREATE TABLE IF NOT EXISTS admin_roles (role_id INTEGER PRIMARY KEY, perm_level TEXT)")
-        
-        # ユーザーごとの設定
-        await conn.execute("""CREATE TABLE IF NOT EXISTS user_settings (
-            user_id INTEGER PRIMARY KEY, 
-            dm_salary_enabled INTEGER DEFAULT 1
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS voice_stats (
-            user_id INTEGER, 
-            month TEXT, 
-            total_seconds INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, month)
-        )""")
-        
-        await conn.execute("CREATE TABLE IF NOT EXISTS voice_tracking (user_id INTEGER PRIMARY KEY, join_time TEXT)")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS temp_vcs (
-            channel_id INTEGER PRIMARY KEY,
-            guild_id INTEGER,
-            owner_id INTEGER,
-            expire_at DATETIME,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        await conn.execute("CREATE TABLE IF NOT EXISTS reward_channels (channel_id INTEGER PRIMARY KEY)")
-
-        # VC在室時間ランキング用（全VC対象）
-        await conn.execute("""CREATE TABLE IF NOT EXISTS vc_rank_stats (
-            user_id INTEGER,
-            month TEXT,
-            total_seconds INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, month)
-        )""")
-
-        # メッセージ数ランキング用
-        await conn.execute("""CREATE TABLE IF NOT EXISTS message_stats (
-            user_id INTEGER,
-            month TEXT,
-            count INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, month)
-        )""")
-
-        # レベルシステム用（累計）
-        await conn.execute("""CREATE TABLE IF NOT EXISTS user_levels (
-            user_id INTEGER PRIMARY KEY,
-            xp INTEGER DEFAULT 0,
-            level INTEGER DEFAULT 0,
-            total_vc_seconds INTEGER DEFAULT 0,
-            total_messages INTEGER DEFAULT 0
-        )""")
-
-        # 縁システム用
-        await conn.execute("""CREATE TABLE IF NOT EXISTS bonds (
-            user_a INTEGER,
-            user_b INTEGER,
-            total_seconds INTEGER DEFAULT 0,
-            rank TEXT DEFAULT '',
-            PRIMARY KEY (user_a, user_b)
-        )""")
-
-        # 4. インデックス
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_trans_receiver ON transactions (receiver_id, created_at DESC)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_temp_vc_expire ON temp_vcs (expire_at)")
-        
-
-        # 5. ショップ・スロット・統計
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS shop_items (
-                role_id TEXT,
-                shop_id TEXT,
-                price INTEGER,
-                description TEXT,
-                item_type TEXT DEFAULT 'rental',
-                max_per_user INTEGER DEFAULT 0,
-                PRIMARY KEY (role_id, shop_id)
-            )
-        """)
-
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS shop_subscriptions (
-                user_id INTEGER,
-                role_id INTEGER,
-                expiry_date TEXT,
-                PRIMARY KEY (user_id, role_id)
-            )
-        """)
+        req_index = LEVEL_RANK.get(required_level, UNKNOWN_LEVEL_RANK)
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS ticket_inventory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                shop_id TEXT,
-                item_key TEXT,
-                item_name TEXT,
-                purchased_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                used_at DATETIME,
-                used_by INTEGER
-            )
-        """)
+        bot = interaction.client
+        role_ids = frozenset(role.id for role in interaction.user.roles)
+        key = (interaction.user.id, required_level, hash(role_ids))
+        now = time.monotonic()
+        hit = bot._perm_cache.get(key)
+        if hit is not None and hit[1] > now:
+            allowed = hit[0]
+        else:
+            # 持っている管理ロールのうち最も強いものだけ見ればよい
+            ranks = bot.config.admin_role_ranks
+            matched = role_ids & ranks.keys()
+            allowed = bool(matched) and min(ranks[r_id] for r_id in matched) <= req_index # インデックスが小さいほど偉い
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS lottery_tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                number INTEGER
-            )
-        """)
+            # ロールで足りない時だけオーナー判定（起動時に取得したID集合で見る）
+            if not allowed:
+                allowed = interaction.user.id in bot._owner_id_set
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS slot_states (
-                user_id INTEGER PRIMARY KEY,
-                spins_since_win INTEGER DEFAULT 0
-            )
-        """)
+            if len(bot._perm_cache) >= PERM_CACHE_MAX:
+                bot._perm_cache.pop(next(iter(bot._perm_cache)))  # 一番古いものから捨てる
+            bot._perm_cache[key] = (allowed, now + PERM_CACHE_TTL)
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                date          TEXT PRIMARY KEY,
-                total_stell   INTEGER DEFAULT 0,
-                total_cesta   INTEGER DEFAULT 0,
-                gini          REAL    DEFAULT 0
-            )
-        """)
-                
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS stock_issuers (
-                user_id INTEGER PRIMARY KEY,
-                total_shares INTEGER DEFAULT 0,
-                is_listed INTEGER DEFAULT 1
-            )
-        """)
-
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS stock_holdings (
-                user_id INTEGER,
-                issuer_id INTEGER,
-                amount INTEGER,
-                avg_cost REAL,
-                PRIMARY KEY (user_id, issuer_id)
-            )
-        """)
+        if allowed:
+            return True
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS market_config (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
+        raise app_commands.AppCommandError(f"この操作には '{required_level}' 以上の権限が必要です。")
+    return app_commands.check(predicate)
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS daily_play_counts (
-                user_id INTEGER,
-                game TEXT,
-                date TEXT,
-                count INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, game, date)
-            )
-        """)
+# ── 頻出SQL ──
+# 文字列を完全に一致させることで、接続ごとのステートメントキャッシュ（コンパイル済み）が再利用される
+SQL_GET_BALANCE = "SELECT balance FROM accounts WHERE user_id = ?"
+SQL_DEBIT       = "UPDATE accounts SET balance = balance - ? WHERE user_id = ?"
+SQL_CREDIT      = "UPDATE accounts SET balance = balance + ? WHERE user_id = ?"
+SQL_TRY_DEBIT   = "UPDATE accounts SET balance = balance - ? WHERE user_id = ? AND balance >= ?"
+# 更新後の残高もその場で返す版（SQLite 3.35+ の RETURNING）
+SQL_TRY_DEBIT_RETURNING = SQL_TRY_DEBIT + " RETURNING balance"
+SQL_CREDIT_UPSERT = (
+    "INSERT INTO accounts (user_id, balance, total_earned) VALUES (?, ?, 0) "
+    "ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance"
+)
+SQL_CREDIT_UPSERT_RETURNING = SQL_CREDIT_UPSERT + " RETURNING balance"
+SQL_INSERT_TX   = "INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag) VALUES (?, ?, ?, ?, ?, ?)"
+# 日次プレイ回数（ゲーム名もパラメータにして、全ゲームで同じ文を使い回す）
+SQL_DAILY_COUNT  = "SELECT count FROM daily_play_counts WHERE user_id = ? AND game = ? AND date = ?"
+# セスタ建てゲームの開始前チェック（免除・今日の回数・セスタ残高）を1回で読む
+SQL_PLAY_GATE = """
+    SELECT EXISTS(SELECT 1 FROM daily_play_exemptions WHERE user_id = :uid AND game = :game AND date = :today) AS exempt,
+           COALESCE((SELECT count FROM daily_play_counts WHERE user_id = :uid AND game = :game AND date = :today), 0) AS count,
+           COALESCE((SELECT balance FROM cesta_wallets WHERE user_id = :uid), 0) AS balance
+"""
+SQL_CESTA_DEBIT = "UPDATE cesta_wallets SET balance = balance - ? WHERE user_id = ?"
+SQL_BUMP_DAILY_COUNT = (
+    "INSERT INTO daily_play_counts (user_id, game, date, count) VALUES (?, ?, ?, 1) "
+    "ON CONFLICT(user_id, game, date) DO UPDATE SET count = count + 1"
+)
+SQL_DM_PREF = "SELECT dm_salary_enabled FROM user_settings WHERE user_id = ?"
+SQL_INSERT_TEMP_VC       = "INSERT INTO temp_vcs (channel_id, guild_id, owner_id, expire_at) VALUES (?, ?, ?, ?) ON CONFLICT(owner_id) DO NOTHING"
+SQL_DELETE_TEMP_VC_OWNER = "DELETE FROM temp_vcs WHERE owner_id = ?"
+
+# 取引ログの月タグ（YYYY-MM）。毎回 datetime を組み立てないよう、翌月1日0時（ローカル時刻）までキャッシュ
+_month_tag_cache = ["", 0.0]
+
+def _month_tag() -> str:
+    now = time.time()
+    if now >= _month_tag_cache[1]:
+        t = time.localtime(now)
+        _month_tag_cache[0] = f"{t.tm_year:04d}-{t.tm_mon:02d}"
+        # 1日0時ちょうどに給与を配っても前月のタグにならないよう、期限は月の切り替わりそのものにする
+        year, month = (t.tm_year + 1, 1) if t.tm_mon == 12 else (t.tm_year, t.tm_mon + 1)
+        _month_tag_cache[1] = time.mktime((year, month, 1, 0, 0, 0, 0, 0, -1))
+    return _month_tag_cache[0]
+
+def _day_tag(dt: datetime.datetime) -> str:
+    """日付キー（YYYY-MM-DD）。strftime を通さず整数の書式化だけで作る"""
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+
+async def fetchone(db, sql: str, params=()):
+    """1行だけ取得する。execute→fetchone→close を1回のスレッド往復で済ませる"""
+    rows = await db.execute_fetchall(sql, params)
+    return rows[0] if rows else None
+
+async def try_debit(db, user_id: int, amount: int) -> bool:
+    """残高が足りる時だけ引き落とす（確認と更新を1文で行う）。足りなければ False"""
+    async with db.execute(SQL_TRY_DEBIT, (amount, user_id, amount)) as cur:
+        return cur.rowcount == 1
+
+# 通知などの後回しにできる処理。完了前に GC されないよう参照を保持しておく
+_background_tasks: set = set()
+
+def spawn(coro) -> asyncio.Task:
+    """応答を待たせずにバックグラウンドで実行する"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+class TokenBucket:
+    """per 秒あたり rate 回まで通す簡易レート制限（空いている時は待たない）"""
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.per)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.per / self.rate)
+
+# ── スキーマ定義（起動時に executescript で一括実行） ──
+SCHEMA_SQL = """
+-- 1. 口座・取引
+CREATE TABLE IF NOT EXISTS accounts (
+    user_id INTEGER PRIMARY KEY,
+    balance INTEGER DEFAULT 0 CHECK(balance >= 0),
+    total_earned INTEGER DEFAULT 0
+);
+INSERT OR IGNORE INTO accounts (user_id, balance, total_earned) VALUES (0, 0, 0);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender_id INTEGER REFERENCES accounts(user_id),
+    receiver_id INTEGER REFERENCES accounts(user_id),
+    amount INTEGER,
+    type TEXT,
+    batch_id TEXT,
+    month_tag TEXT,
+    description TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 2. 設定・権限
+-- TEXT主キー・複合主キーの表は WITHOUT ROWID（主キー索引と本体を1本のB-treeにまとめる）
+-- INTEGER PRIMARY KEY 単独の表は元々 rowid そのものなので対象外
+CREATE TABLE IF NOT EXISTS server_config (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS role_wages (role_id INTEGER PRIMARY KEY, amount INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS admin_roles (role_id INTEGER PRIMARY KEY, perm_level TEXT);
+
+-- ユーザーごとの設定
+CREATE TABLE IF NOT EXISTS user_settings (
+    user_id INTEGER PRIMARY KEY,
+    dm_salary_enabled INTEGER DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS voice_stats (
+    user_id INTEGER,
+    month TEXT,
+    total_seconds INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS voice_tracking (user_id INTEGER PRIMARY KEY, join_time TEXT);
+CREATE TABLE IF NOT EXISTS temp_vcs (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    owner_id INTEGER,
+    expire_at INTEGER,  -- UNIX秒
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS reward_channels (channel_id INTEGER PRIMARY KEY);
+
+-- VC在室時間ランキング用（全VC対象）
+CREATE TABLE IF NOT EXISTS vc_rank_stats (
+    user_id INTEGER,
+    month TEXT,
+    total_seconds INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+
+-- メッセージ数ランキング用
+CREATE TABLE IF NOT EXISTS message_stats (
+    user_id INTEGER,
+    month TEXT,
+    count INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+
+-- レベルシステム用（累計）
+CREATE TABLE IF NOT EXISTS user_levels (
+    user_id INTEGER PRIMARY KEY,
+    xp INTEGER DEFAULT 0,
+    level INTEGER DEFAULT 0,
+    total_vc_seconds INTEGER DEFAULT 0,
+    total_messages INTEGER DEFAULT 0
+);
+
+-- 縁システム用
+CREATE TABLE IF NOT EXISTS bonds (
+    user_a INTEGER,
+    user_b INTEGER,
+    total_seconds INTEGER DEFAULT 0,
+    rank TEXT DEFAULT '',
+    PRIMARY KEY (user_a, user_b)
+) WITHOUT ROWID;
+
+-- 4. インデックス
+CREATE INDEX IF NOT EXISTS idx_trans_receiver ON transactions (receiver_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_temp_vc_expire ON temp_vcs (expire_at);
+-- 一時VCの1人1部屋の索引（idx_temp_vc_owner）は、古いDBの重複を片付けてから BankDatabase.setup で張る
+-- 期間集計（経済レポートの24時間フロー）用
+CREATE INDEX IF NOT EXISTS idx_trans_created ON transactions (created_at);
+-- 残高ランキング用（user_id は rowid そのものなので、残高参照自体に追加の索引は不要）
+CREATE INDEX IF NOT EXISTS idx_accounts_balance ON accounts (balance DESC);
+-- 取引履歴（送金側）用。受取側の索引と合わせて sender_id OR receiver_id を両索引で引ける
+CREATE INDEX IF NOT EXISTS idx_trans_sender ON transactions (sender_id, created_at DESC);
+-- 給与ロールバック用（batch_id は一括支給の行にしか入らないので部分索引で十分）
+CREATE INDEX IF NOT EXISTS idx_trans_batch ON transactions (batch_id) WHERE batch_id IS NOT NULL;
+-- 月間ランキング用（user_id まで含めて索引だけで結果を返せるようにする）
+CREATE INDEX IF NOT EXISTS idx_vcrank_month_secs ON vc_rank_stats (month, total_seconds DESC, user_id);
+CREATE INDEX IF NOT EXISTS idx_msgstats_month_count ON message_stats (month, count DESC, user_id);
+-- 縁・レベルの順位用
+CREATE INDEX IF NOT EXISTS idx_bonds_secs ON bonds (total_seconds DESC);
+CREATE INDEX IF NOT EXISTS idx_levels_xp ON user_levels (xp DESC);
+
+-- 5. ショップ・スロット・統計
+CREATE TABLE IF NOT EXISTS shop_items (
+    role_id TEXT,
+    shop_id TEXT,
+    price INTEGER,
+    description TEXT,
+    item_type TEXT DEFAULT 'rental',
+    max_per_user INTEGER DEFAULT 0,
+    PRIMARY KEY (role_id, shop_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS shop_subscriptions (
+    user_id INTEGER,
+    role_id INTEGER,
+    expiry_date TEXT,
+    PRIMARY KEY (user_id, role_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ticket_inventory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    shop_id TEXT,
+    item_key TEXT,
+    item_name TEXT,
+    purchased_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    used_at DATETIME,
+    used_by INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS lottery_tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    number INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS slot_states (
+    user_id INTEGER PRIMARY KEY,
+    spins_since_win INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS daily_stats (
+    date          TEXT PRIMARY KEY,
+    total_stell   INTEGER DEFAULT 0,
+    total_cesta   INTEGER DEFAULT 0,
+    gini          REAL    DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stock_issuers (
+    user_id INTEGER PRIMARY KEY,
+    total_shares INTEGER DEFAULT 0,
+    is_listed INTEGER DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS stock_holdings (
+    user_id INTEGER,
+    issuer_id INTEGER,
+    amount INTEGER,
+    avg_cost REAL,
+    PRIMARY KEY (user_id, issuer_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS market_config (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_play_counts (
+    user_id INTEGER,
+    game TEXT,
+    date TEXT,
+    count INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, game, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_play_exemptions (
+    user_id INTEGER,
+    game TEXT,
+    date TEXT,
+    PRIMARY KEY (user_id, game, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cesta_wallets (
+    user_id INTEGER PRIMARY KEY,
+    balance INTEGER DEFAULT 0 CHECK(balance >= 0)
+);
+
+CREATE TABLE IF NOT EXISTS cesta_daily_claims (
+    user_id INTEGER PRIMARY KEY,
+    last_claim TEXT
+);
+
+CREATE TABLE IF NOT EXISTS cesta_daily_purchases (
+    user_id INTEGER,
+    date TEXT,
+    amount INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS slot_cooldowns (
+    user_id INTEGER PRIMARY KEY,
+    last_play TEXT,
+    bigwin_until TEXT
+);
+
+CREATE TABLE IF NOT EXISTS slot_streaks (
+    user_id INTEGER PRIMARY KEY,
+    win_streak INTEGER DEFAULT 0,
+    lose_streak INTEGER DEFAULT 0
+);
+
+-- セスタショップ関連
+CREATE TABLE IF NOT EXISTS cesta_badges (
+    user_id    INTEGER,
+    badge_id   TEXT,
+    granted_at TEXT,
+    PRIMARY KEY (user_id, badge_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cesta_spent (
+    user_id       INTEGER PRIMARY KEY,
+    total_spent   INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS cesta_shop_items (
+    item_id      TEXT PRIMARY KEY,
+    name         TEXT,
+    description  TEXT,
+    price        INTEGER,
+    item_type    TEXT,
+    required_badge TEXT,
+    role_id      INTEGER,
+    duration_days INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS cesta_shop_subs (
+    user_id    INTEGER,
+    item_id    TEXT,
+    expiry     TEXT,
+    PRIMARY KEY (user_id, item_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cesta_tickets (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id      INTEGER,
+    item_id      TEXT,
+    item_name    TEXT,
+    purchased_at TEXT,
+    used_at      TEXT,
+    used_by      INTEGER
+);
+CREATE TABLE IF NOT EXISTS cesta_badge_thresholds (
+    badge_id     TEXT PRIMARY KEY,
+    threshold    INTEGER
+) WITHOUT ROWID;
+-- デフォルト閾値を挿入
+INSERT OR IGNORE INTO cesta_badge_thresholds VALUES ('入場券', 100);
+INSERT OR IGNORE INTO cesta_badge_thresholds VALUES ('道化師の証', 500);
+INSERT OR IGNORE INTO cesta_badge_thresholds VALUES ('座長の印', 2000);
+
+CREATE TABLE IF NOT EXISTS ticket_config (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ticket_types (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE,
+    emoji TEXT,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id INTEGER UNIQUE,
+    user_id INTEGER,
+    type_name TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    closed_at DATETIME,
+    closed_by INTEGER
+);
+
+-- ジャックポット用
+CREATE TABLE IF NOT EXISTS jackpot_tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    ticket_id BLOB,  -- uuid.UUID(...).bytes（16バイト）
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 統計レポート用
+CREATE TABLE IF NOT EXISTS last_stats_report (
+    id INTEGER PRIMARY KEY,
+    total_balance INTEGER,
+    gini_val REAL,
+    timestamp DATETIME
+);
+"""
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS daily_play_exemptions (
-                user_id INTEGER,
-                game TEXT,
-                date TEXT,
-                PRIMARY KEY (user_id, game, date)
-            )
-        """)
+class BankDatabase:
+    def __init__(self, db_path="stella_bank_v1.db", pool_size: int = 4, writer_pool_size: int = 1):
+        self.db_path = db_path
+        # 接続プール（開きっぱなしの接続を使い回す）
+        self.pool_size = pool_size
+        # 書き込み用は1本を使い続ける（ページキャッシュが温まったまま、WALの書き込みロックも取り合わない）
+        # 同時に書き込みが来た時だけ一時的な接続を開き、使い終わったら閉じる
+        self.writer_pool_size = writer_pool_size
+        self._idle: List[aiosqlite.Connection] = []
+        # 読み取り専用の接続（WALなので書き込み中でも待たされずに読める）
+        self._idle_readers: List[aiosqlite.Connection] = []
+        self._lock = asyncio.Lock()
+        self._closed = False
+        # 取引ログの書き込みキュー（まとめて1トランザクションで書く）
+        self._tx_queue: asyncio.Queue = asyncio.Queue()
+        self._tx_inflight: List[tuple] = []
+        self._tx_retries = 0
+        self._tx_stop = asyncio.Event()
+        self._tx_task: Optional[asyncio.Task] = None
+
+    async def _open(self, readonly: bool = False) -> aiosqlite.Connection:
+        if readonly:
+            # 参照用は読み取り専用モードで開く（共有キャッシュはテーブルロックで
+            # WALの読み書き並行性を潰すので使わない）
+            uri = pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            conn = await aiosqlite.connect(uri, uri=True, cached_statements=256)
+        else:
+            # 書き込み用は暗黙のトランザクションを BEGIN IMMEDIATE で始める
+            # （最初の書き込みの時点で書き込みロックを取り、途中での昇格待ちを起こさない）
+            conn = await aiosqlite.connect(self.db_path, cached_statements=256, isolation_level="IMMEDIATE")
+        conn.row_factory = aiosqlite.Row
+        # 接続ごとのPRAGMAは開いた時に1回だけ
+        await conn.execute("PRAGMA foreign_keys = ON")
+        await conn.execute("PRAGMA busy_timeout = 5000")
+        await conn.execute("PRAGMA synchronous = NORMAL")      # WAL下では安全
+        await conn.execute("PRAGMA temp_store = MEMORY")
+        await conn.execute("PRAGMA cache_size = -65536")       # 64 MiB
+        await conn.execute("PRAGMA mmap_size = 1073741824")    # 1 GiB
+        await conn.execute("PRAGMA wal_autocheckpoint = 1000")
+        return conn
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS cesta_wallets (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER DEFAULT 0 CHECK(balance >= 0)
-            )
-        """)
+    @contextlib.asynccontextmanager
+    async def acquire(self, readonly: bool = False):
+        """プールから接続を1本借りる。使用中の接続は他のブロックと共有しない
+        readonly=True なら参照専用の接続を借りる（書き込みはエラーになる）"""
+        idle = self._idle_readers if readonly else self._idle
+        async with self._lock:
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = await self._open(readonly)
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS cesta_daily_claims (
-                user_id INTEGER PRIMARY KEY,
-                last_claim TEXT
-            )
-        """)
+        try:
+            yield conn
+        finally:
+            # commitされずに残ったトランザクションは次の利用者へ持ち越さない
+            try:
+                if conn.in_transaction:
+                    await conn.rollback()
+                reusable = True
+            except Exception:
+                reusable = False
+
+            limit = self.pool_size if readonly else self.writer_pool_size
+            async with self._lock:
+                if reusable and not self._closed and len(idle) < limit:
+                    idle.append(conn)
+                    conn = None
+            if conn is not None:
+                await conn.close()
+
+    async def warm_up(self, readers: int = 2, writers: int = 1):
+        """起動時に接続を先に開いてプールへ入れておく（最初のコマンドで接続を開く待ちをなくす）"""
+        for readonly, count in ((True, readers), (False, writers)):
+            limit = self.pool_size if readonly else self.writer_pool_size
+            conns = [await self._open(readonly) for _ in range(min(count, limit))]
+            async with self._lock:
+                (self._idle_readers if readonly else self._idle).extend(conns)
+
+    # ── 取引ログのまとめ書き ──
+    TX_FLUSH_INTERVAL = 0.25
+    TX_FLUSH_MAX = 500
+    TX_FLUSH_RETRIES = 5  # 書けなかった分はこの回数まで持ち越し、超えたらログに残して捨てる
+    TX_RETRY_DELAY = 2.0
+
+    def start_tx_writer(self):
+        if self._tx_task is None or self._tx_task.done():
+            self._tx_task = asyncio.create_task(self._tx_writer())
+
+    def log_transaction(self, sender_id: int, receiver_id: int, amount: int, tx_type: str, description: str, month_tag: str):
+        """取引ログを予約する（残高の更新とは別に、少し遅れてまとめて書かれる）"""
+        self._tx_queue.put_nowait((sender_id, receiver_id, amount, tx_type, description, month_tag))
+
+    async def _tx_writer(self):
+        # 終了の合図（_tx_stop と、待ち受けを起こすための None）を受けたら、残りを書き切ってから抜ける
+        while True:
+            if not self._tx_inflight:
+                if self._tx_stop.is_set() and self._tx_queue.empty():
+                    return
+                row = await self._tx_queue.get()
+                if row is None:
+                    continue
+                self._tx_inflight = [row]
+            if not self._tx_stop.is_set():
+                # 前回書けなかった分が残っている時は少し間を空けてから再挑戦する
+                await asyncio.sleep(self.TX_RETRY_DELAY if self._tx_retries else self.TX_FLUSH_INTERVAL)
+            while len(self._tx_inflight) < self.TX_FLUSH_MAX and not self._tx_queue.empty():
+                row = self._tx_queue.get_nowait()
+                if row is not None:
+                    self._tx_inflight.append(row)
+            await self._write_tx()
+
+    async def _write_tx(self):
+        rows = self._tx_inflight
+        try:
+            async with self.acquire() as db:
+                await db.executemany(SQL_INSERT_TX, rows)
+                await db.commit()
+            self._tx_inflight = []
+            self._tx_retries = 0
+            return
+        except Exception as e:
+            logger.error("Transaction Log Flush Error: %s", e)
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS cesta_daily_purchases (
-                user_id INTEGER,
-                date TEXT,
-                amount INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, date)
-            )
-        """)
+        # まとめて書けなかった時は1行ずつ書き、書けなかった行だけを次回へ持ち越す
+        failed, done = [], 0
+        try:
+            async with self.acquire() as db:
+                for row in rows:
+                    done += 1
+                    try:
+                        await db.execute(SQL_INSERT_TX, row)
+                        await db.commit()
+                    except Exception as e:
+                        logger.error("Transaction Log Row Error: %s: %r", e, row)
+                        failed.append(row)
+                        if db.in_transaction:
+                            await db.rollback()
+        except Exception as e:
+            logger.error("Transaction Log Flush Error: %s", e)
+            failed.extend(rows[done:])
 
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS slot_cooldowns (
-                user_id INTEGER PRIMARY KEY,
-                last_play TEXT,
-                bigwin_until TEXT
-            )
-        """)
+        self._tx_inflight = failed
+        if not failed:
+            self._tx_retries = 0
+            return
+        self._tx_retries += 1
+        if self._tx_retries < self.TX_FLUSH_RETRIES:
+            return
+        logger.error("Transaction Log Flush Error: giving up on %d rows", len(failed))
+        for row in failed:
+            logger.error("Dropped transaction log: %r", row)
+        self._tx_inflight = []
+        self._tx_retries = 0
+
+    async def flush_tx(self):
+        """書き込み待ちの取引ログを全て書き出す（終了時用）
+        書き込み中のタスクを cancel すると、スレッド側で進んでいる書き込みと二重に書いてしまうので、
+        合図を送って書き手が自分で書き切って抜けるのを待つ"""
+        self._tx_stop.set()
+        self._tx_queue.put_nowait(None)
+        if self._tx_task:
+            if not self._tx_task.done():
+                await self._tx_task
+            self._tx_task = None
+        # 書き手が動いていなかった（または先に落ちていた）場合はここで書き切る。空ならすぐ戻る
+        await self._tx_writer()
+
+    async def close(self):
+        await self.flush_tx()
+        # 終了前に空きページを返却し、WALを本体へ書き戻して切り詰めておく
+        try:
+            async with self.acquire() as db:
+                # execute だと1ステップ（1ページ）しか進まないので、executescript で最後まで回す
+                await db.executescript("PRAGMA incremental_vacuum;")
+                await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logger.error("DB Checkpoint Failure: %s", e)
+        async with self._lock:
+            self._closed = True
+            conns = self._idle + self._idle_readers
+            self._idle, self._idle_readers = [], []
+        for conn in conns:
+            await conn.close()
 
+    async def setup(self, conn):
+        # auto_vacuum はテーブル作成前（新規DB）にしか効かない。既存DBでは何もしない
+        await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WALはDBファイルに記録されるので1回設定すれば以後の接続にも効く
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.executescript(SCHEMA_SQL)
+        # 旧形式（ローカル時刻の文字列）で残っている一時VCの期限をUNIX秒へ変換
+        await conn.execute(
+            "UPDATE temp_vcs SET expire_at = CAST(strftime('%s', expire_at, 'utc') AS INTEGER) WHERE typeof(expire_at) = 'text'"
+        )
+        # 一時VCは1人1部屋。古いDBに残っている重複（古い方）は行を消すとチャンネルが残り続けるので、
+        # 期限切れにして毎分の掃除（チャンネルごと削除）へ回す。owner_id は実在しない負の値へ付け替えて一意にする
         await conn.execute("""
-            CREATE TABLE IF NOT EXISTS slot_streaks (
-                user_id INTEGER PRIMARY KEY,
-                win_streak INTEGER DEFAULT 0,
-                lose_streak INTEGER DEFAULT 0
-            )
+            UPDATE temp_vcs SET owner_id = -channel_id, expire_at = 0
+            WHERE owner_id > 0
+              AND channel_id NOT IN (SELECT MAX(channel_id) FROM temp_vcs GROUP BY owner_id)
         """)
-# セスタショップ関連
-        await conn.execute("""CREATE TABLE IF NOT EXISTS cesta_badges (
-            user_id    INTEGER,
-            badge_id   TEXT,
-            granted_at TEXT,
-            PRIMARY KEY (user_id, badge_id)
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS cesta_spent (
-            user_id       INTEGER PRIMARY KEY,
-            total_spent   INTEGER DEFAULT 0
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS cesta_shop_items (
-            item_id      TEXT PRIMARY KEY,
-            name         TEXT,
-            description  TEXT,
-            price        INTEGER,
-            item_type    TEXT,
-            required_badge TEXT,
-            role_id      INTEGER,
-            duration_days INTEGER DEFAULT 0
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS cesta_shop_subs (
-            user_id    INTEGER,
-            item_id    TEXT,
-            expiry     TEXT,
-            PRIMARY KEY (user_id, item_id)
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS cesta_tickets (
-            id           INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id      INTEGER,
-            item_id      TEXT,
-            item_name    TEXT,
-            purchased_at TEXT,
-            used_at      TEXT,
-            used_by      INTEGER
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS cesta_badge_thresholds (
-            badge_id     TEXT PRIMARY KEY,
-            threshold    INTEGER
-        )""")
-        # デフォルト閾値を挿入
-        await conn.execute("INSERT OR IGNORE INTO cesta_badge_thresholds VALUES ('入場券', 100)")
-        await conn.execute("INSERT OR IGNORE INTO cesta_badge_thresholds VALUES ('道化師の証', 500)")
-        await conn.execute("INSERT OR IGNORE INTO cesta_badge_thresholds VALUES ('座長の印', 2000)")
-
-        await conn.execute("""CREATE TABLE IF NOT EXISTS ticket_config (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS ticket_types (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE,
-            emoji TEXT,
-            description TEXT
-        )""")
-        await conn.execute("""CREATE TABLE IF NOT EXISTS tickets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            channel_id INTEGER UNIQUE,
-            user_id INTEGER,
-            type_name TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            closed_at DATETIME,
-            closed_by INTEGER
-        )""")
-        
+        await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_temp_vc_owner ON temp_vcs (owner_id)")
         await conn.commit()
+        # 新しい索引をプランナに認識させる
+        await conn.execute("PRAGMA optimize")
 
 
 # ── UI: VC内操作パネル ──
@@ -439,15 +783,19 @@ class VCControlView(discord.ui.View):
             use_voice_activation=True, send_messages=True, read_message_history=True
         )
 
+        # 権限の上書きは手元でまとめて組み立て、1回の channel.edit で反映する
+        overwrites = dict(channel.overwrites)
         added_users = []
         for member in select.values:
             if member.bot: continue
-            await channel.set_permissions(member, overwrite=perms)
+            overwrites[member] = perms
             added_users.append(member.display_name)
 
         if not added_users:
             return await interaction.followup.send("❌ 招待できるメンバーがいませんでした。", ephemeral=True)
 
+        await channel.edit(overwrites=overwrites, reason="Temp VC Invite")
+
         await interaction.followup.send(f"✅ 以下のメンバーを招待しました:\n{', '.join(added_users)}", ephemeral=True)
         await channel.send(f"👋 {interaction.user.mention} が {', '.join([m.mention for m in select.values if not m.bot])} を招待しました。")
 
@@ -466,71 +814,106 @@ class RemoveUserView(discord.ui.View):
         await interaction.response.defer(ephemeral=True)
         channel = interaction.channel
 
+        overwrites = dict(channel.overwrites)
         removed_names = []
+        in_vc = []
         for member in select.values:
             if member.id == interaction.user.id: continue
             if member.bot: continue
-            await channel.set_permissions(member, overwrite=None)
+            overwrites.pop(member, None)
             if member.voice and member.voice.channel and member.voice.channel.id == channel.id:
-                await member.move_to(None)
+                in_vc.append(member)
             removed_names.append(member.display_name)
 
         if removed_names:
+            # 権限の剥奪は1回の channel.edit で、在室者の切断は並行で行う
+            await channel.edit(overwrites=overwrites, reason="Temp VC Kick")
+            await asyncio.gather(*(m.move_to(None) for m in in_vc))
             await interaction.followup.send(f"🚫 以下のメンバーの権限を剥奪しました:\n{', '.join(removed_names)}", ephemeral=True)
         else:
             await interaction.followup.send("❌ 対象を選択してください（自分自身は削除できません）。", ephemeral=True)
 
 
 # ── UI: プラン選択メニュー ──
+@functools.lru_cache(maxsize=32)
+def _build_plan_options(p6: int, p12: int, p24: int, public: bool) -> tuple:
+    """価格の組ごとにプランの選択肢を1回だけ作って使い回す"""
+    if public:
+        return (
+            discord.SelectOption(label="6時間プラン",  description=f"{p6:,} Stell",  value="6",  emoji="🕐"),
+            discord.SelectOption(label="12時間プラン", description=f"{p12:,} Stell", value="12", emoji="🕓"),
+            discord.SelectOption(label="24時間プラン", description=f"{p24:,} Stell", value="24", emoji="🕛"),
+        )
+    return (
+        discord.SelectOption(label="6時間プラン",  description=f"{p6:,} Stell - ちょっとした作業や会議に", value="6",  emoji="🕐"),
+        discord.SelectOption(label="12時間プラン", description=f"{p12:,} Stell - 半日じっくり",             value="12", emoji="🕓"),
+        discord.SelectOption(label="24時間プラン", description=f"{p24:,} Stell - 丸一日貸切",               value="24", emoji="🕛"),
+    )
+
+@functools.lru_cache(maxsize=64)
+def _panel_desc(p6: int, p12: int, p24: int, public: bool) -> str:
+    """VC作成パネルの既定の説明文（価格の組ごとに1回だけ組み立てる）"""
+    if public:
+        head = (
+            "誰でも入れる公開一時VCを作成できます。\n\n"
+            "**🔓 公開ルーム**\n設定された一部のロールを除き誰でも参加できます\n"
+        )
+    else:
+        head = (
+            "権限のある人以外からは見えない、プライベートな一時VCを作成できます。ようこそアパホテルへ\n\n"
+            "**🔒 プライバシー**\n招待した人以外は見えません\n"
+        )
+    return (
+        head +
+        "**🛡 料金システム**\n作成時に自動引き落とし\n"
+        "**⏰ 料金プラン**\n"
+        f"• **6時間**: {p6:,} Stell\n"
+        f"• **12時間**: {p12:,} Stell\n"
+        f"• **24時間**: {p24:,} Stell"
+    )
+
 class PlanSelect(discord.ui.Select):
     def __init__(self, prices: dict):
         self.prices = prices
-        options = [
-            discord.SelectOption(label="6時間プラン",  description=f"{prices.get('6',  5000):,} Stell - ちょっとした作業や会議に", value="6",  emoji="🕐"),
-            discord.SelectOption(label="12時間プラン", description=f"{prices.get('12', 10000):,} Stell - 半日じっくり",             value="12", emoji="🕓"),
-            discord.SelectOption(label="24時間プラン", description=f"{prices.get('24', 30000):,} Stell - 丸一日貸切",               value="24", emoji="🕛"),
-        ]
-        super().__init__(placeholder="利用プランを選択してください...", min_values=1, max_values=1, options=options, row=0)
+        options = _build_plan_options(prices.get('6', 5000), prices.get('12', 10000), prices.get('24', 30000), False)
+        super().__init__(placeholder="利用プランを選択してください...", min_values=1, max_values=1, options=list(options), row=0)
 
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
 
         user = interaction.user
         bot = interaction.client
+        hours = int(self.values[0])
+        price = self.prices.get(str(hours), 5000)
+
         async with bot.get_db() as db:
-            async with db.execute("SELECT channel_id FROM temp_vcs WHERE owner_id = ?", (user.id,)) as cursor:
-                existing = await cursor.fetchone()
+            row = await fetchone(db, "SELECT channel_id AS ch FROM temp_vcs WHERE owner_id = ?", (user.id,))
 
-            if existing:
+            if row is not None:
                 # チャンネルが実際に存在するか確認
-                real_channel = bot.get_channel(existing['channel_id'])
+                real_channel = bot.get_channel(row['ch'])
                 if real_channel is None:
-                    # 実在しない → 孤立レコードなので削除してOK
-                    await db.execute("DELETE FROM temp_vcs WHERE owner_id = ?", (user.id,))
-                    await db.commit()
+                    # 実在しない → 孤立レコードなので削除してOK（引き落としと同じコミットで確定）
+                    await db.execute(SQL_DELETE_TEMP_VC_OWNER, (user.id,))
                 else:
                     return await interaction.followup.send("❌ あなたは既に一時VCを作成しています。", ephemeral=True)
 
-        hours = int(self.values[0])
-        price = self.prices.get(str(hours), 5000)
-
-        async with bot.get_db() as db:
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (user.id,)) as cursor:
-                row = await cursor.fetchone()
-                current_bal = row['balance'] if row else 0
-
-            if current_bal < price:
-                return await interaction.followup.send(
-                    f"❌ 残高不足です。\n必要: {price:,} Stell / 所持: {current_bal:,} Stell", ephemeral=True
-                )
+            # 残高確認と引き落としを1文で（同時クリックでも二重に引かれない）
+            error = None
+            if not await try_debit(db, user.id, price):
+                sr = await fetchone(db, SQL_GET_BALANCE, (user.id,))
+                current_bal = sr['balance'] if sr else 0
+                error = f"❌ 残高不足です。\n必要: {price:,} Stell / 所持: {current_bal:,} Stell"
+                # 0行更新でも書き込みトランザクションは開いているので、返信を待つ前に閉じる
+                await db.rollback()
+            else:
+                await db.commit()
+        # 返信は接続を返してから（Discordの応答待ちの間、書き込みロックを持たない）
+        if error:
+            return await interaction.followup.send(error, ephemeral=True)
 
-            month_tag = datetime.datetime.now().strftime("%Y-%m")
-            await db.execute("UPDATE accounts SET balance = balance - ? WHERE user_id = ?", (price, user.id))
-            await db.execute(
-                "INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag) VALUES (?, 0, ?, 'VC_CREATE', ?, ?)",
-                (user.id, price, f"一時VC作成 ({hours}時間)", month_tag)
-            )
-            await db.commit()
+        # 取引ログは書き込みキューでまとめて書く（残高の更新はここで確定済み）
+        bot.db_manager.log_transaction(user.id, 0, price, 'VC_CREATE', f"一時VC作成 ({hours}時間)", _month_tag())
 
         try:
             guild = interaction.guild
@@ -554,11 +937,13 @@ class PlanSelect(discord.ui.Select):
 
             expire_dt = datetime.datetime.now() + datetime.timedelta(hours=hours)
             async with bot.get_db() as db:
-                await db.execute(
-                    "INSERT INTO temp_vcs (channel_id, guild_id, owner_id, expire_at) VALUES (?, ?, ?, ?)",
-                    (new_vc.id, guild.id, user.id, expire_dt)
-                )
+                async with db.execute(SQL_INSERT_TEMP_VC, (new_vc.id, guild.id, user.id, int(expire_dt.timestamp()))) as cur:
+                    inserted = cur.rowcount == 1
                 await db.commit()
+            if not inserted:
+                # 同時クリックで先に別の部屋が登録されていた → 今作った部屋は片付けて返金へ
+                await new_vc.delete(reason="Duplicate Temp VC")
+                raise RuntimeError("temp vc already registered for this owner")
 
             await new_vc.send(
                 f"{user.mention} ようこそ！\nこのパネルを使って、友達を招待したり権限を管理できます。\n(時間が来るとこのチャンネルは自動消滅します)",
@@ -570,21 +955,17 @@ class PlanSelect(discord.ui.Select):
             )
 
         except Exception as e:
-            logger.error(f"VC Create Error: {e}")
+            logger.error("VC Create Error: %s", e)
             async with bot.get_db() as db:
-                await db.execute("UPDATE accounts SET balance = balance + ? WHERE user_id = ?", (price, user.id))
+                await db.execute(SQL_CREDIT, (price, user.id))
                 await db.commit()
             await interaction.followup.send("❌ VC作成中にエラーが発生しました。料金を返金しました。", ephemeral=True)
 
 class PublicPlanSelect(discord.ui.Select):
     def __init__(self, prices: dict):
         self.prices = prices
-        options = [
-            discord.SelectOption(label="6時間プラン",  description=f"{prices.get('6',  10000):,} Stell", value="6",  emoji="🕐"),
-            discord.SelectOption(label="12時間プラン", description=f"{prices.get('12', 30000):,} Stell", value="12", emoji="🕓"),
-            discord.SelectOption(label="24時間プラン", description=f"{prices.get('24', 50000):,} Stell", value="24", emoji="🕛"),
-        ]
-        super().__init__(placeholder="利用プランを選択してください...", min_values=1, max_values=1, options=options, row=0)
+        options = _build_plan_options(prices.get('6', 10000), prices.get('12', 30000), prices.get('24', 50000), True)
+        super().__init__(placeholder="利用プランを選択してください...", min_values=1, max_values=1, options=list(options), row=0)
 
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
@@ -594,40 +975,31 @@ class PublicPlanSelect(discord.ui.Select):
         hours = int(self.values[0])
         price = self.prices.get(str(hours), 10000)
 
-        # 既存VCチェック（プライベート版と共通）
         async with bot.get_db() as db:
-            async with db.execute("SELECT channel_id FROM temp_vcs WHERE owner_id = ?", (user.id,)) as cursor:
-                existing = await cursor.fetchone()
-            if existing:
-                real_channel = bot.get_channel(existing['channel_id'])
+            row = await fetchone(db, "SELECT channel_id AS ch FROM temp_vcs WHERE owner_id = ?", (user.id,))
+
+            # 既存VCチェック（プライベート版と共通）
+            if row is not None:
+                real_channel = bot.get_channel(row['ch'])
                 if real_channel is None:
-                    await db.execute("DELETE FROM temp_vcs WHERE owner_id = ?", (user.id,))
-                    await db.commit()
+                    await db.execute(SQL_DELETE_TEMP_VC_OWNER, (user.id,))
                 else:
                     return await interaction.followup.send("❌ あなたは既に一時VCを作成しています。", ephemeral=True)
 
-        # 残高チェック
-        async with bot.get_db() as db:
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (user.id,)) as cursor:
-                row = await cursor.fetchone()
-                current_bal = row['balance'] if row else 0
-            if current_bal < price:
-                return await interaction.followup.send(
-                    f"❌ 残高不足です。\n必要: {price:,} Stell / 所持: {current_bal:,} Stell", ephemeral=True
-                )
-
-            # 除外ロールを取得
-            async with db.execute("SELECT value FROM server_config WHERE key = 'public_vc_exclude_roles'") as c:
-                row = await c.fetchone()
-            exclude_ids = [int(x) for x in row['value'].split(',') if x] if row and row['value'] else []
-
-            month_tag = datetime.datetime.now().strftime("%Y-%m")
-            await db.execute("UPDATE accounts SET balance = balance - ? WHERE user_id = ?", (price, user.id))
-            await db.execute(
-                "INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag) VALUES (?, 0, ?, 'PUBLIC_VC_CREATE', ?, ?)",
-                (user.id, price, f"公開VC作成 ({hours}時間)", month_tag)
-            )
-            await db.commit()
+            # 残高確認と引き落としを1文で
+            error = None
+            if not await try_debit(db, user.id, price):
+                sr = await fetchone(db, SQL_GET_BALANCE, (user.id,))
+                current_bal = sr['balance'] if sr else 0
+                error = f"❌ 残高不足です。\n必要: {price:,} Stell / 所持: {current_bal:,} Stell"
+                # 0行更新でも書き込みトランザクションは開いているので、返信を待つ前に閉じる
+                await db.rollback()
+            else:
+                await db.commit()
+        # 返信は接続を返してから（Discordの応答待ちの間、書き込みロックを持たない）
+        if error:
+            return await interaction.followup.send(error, ephemeral=True)
+        bot.db_manager.log_transaction(user.id, 0, price, 'PUBLIC_VC_CREATE', f"公開VC作成 ({hours}時間)", _month_tag())
 
         try:
             guild    = interaction.guild
@@ -643,7 +1015,7 @@ class PublicPlanSelect(discord.ui.Select):
                     move_members=True, mute_members=True
                 ),
             }
-            for role_id in exclude_ids:
+            for role_id in bot.config.public_vc_exclude_role_ids:
                 role = guild.get_role(role_id)
                 if role:
                     overwrites[role] = discord.PermissionOverwrite(view_channel=False, connect=False)
@@ -656,11 +1028,13 @@ class PublicPlanSelect(discord.ui.Select):
 
             expire_dt = datetime.datetime.now() + datetime.timedelta(hours=hours)
             async with bot.get_db() as db:
-                await db.execute(
-                    "INSERT INTO temp_vcs (channel_id, guild_id, owner_id, expire_at) VALUES (?, ?, ?, ?)",
-                    (new_vc.id, guild.id, user.id, expire_dt)
-                )
+                async with db.execute(SQL_INSERT_TEMP_VC, (new_vc.id, guild.id, user.id, int(expire_dt.timestamp()))) as cur:
+                    inserted = cur.rowcount == 1
                 await db.commit()
+            if not inserted:
+                # 同時クリックで先に別の部屋が登録されていた → 今作った部屋は片付けて返金へ
+                await new_vc.delete(reason="Duplicate Temp VC")
+                raise RuntimeError("temp vc already registered for this owner")
 
             await interaction.followup.send(
                 f"✅ 公開VC作成完了: {new_vc.mention}\n期限: {expire_dt.strftime('%m/%d %H:%M')}",
@@ -668,9 +1042,9 @@ class PublicPlanSelect(discord.ui.Select):
             )
 
         except Exception as e:
-            logger.error(f"Public VC Create Error: {e}")
+            logger.error("Public VC Create Error: %s", e)
             async with bot.get_db() as db:
-                await db.execute("UPDATE accounts SET balance = balance + ? WHERE user_id = ?", (price, user.id))
+                await db.execute(SQL_CREDIT, (price, user.id))
                 await db.commit()
             await interaction.followup.send("❌ VC作成中にエラーが発生しました。料金を返金しました。", ephemeral=True)
 
@@ -682,19 +1056,8 @@ class PublicVCPanel(discord.ui.View):
     @discord.ui.button(label="公開VCを作成する", style=discord.ButtonStyle.primary, custom_id="create_public_vc_btn", emoji="🔓")
     async def create_vc_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         bot = interaction.client
-        prices = {}
-        async with bot.get_db() as db:
-            async with db.execute("SELECT key, value FROM server_config WHERE key IN ('public_vc_price_6', 'public_vc_price_12', 'public_vc_price_24')") as cursor:
-                rows = await cursor.fetchall()
-                for row in rows:
-                    prices[row['key'].replace('public_vc_price_', '')] = int(row['value'])
-
-        if '6'  not in prices: prices['6']  = 10000
-        if '12' not in prices: prices['12'] = 30000
-        if '24' not in prices: prices['24'] = 50000
-
         view = discord.ui.View()
-        view.add_item(PublicPlanSelect(prices))
+        view.add_item(PublicPlanSelect(bot.config.public_vc_prices))
         await interaction.response.send_message("利用する時間プランを選択してください。", view=view, ephemeral=True)
         
 class VCPanel(discord.ui.View):
@@ -704,19 +1067,8 @@ class VCPanel(discord.ui.View):
     @discord.ui.button(label="一時VCを作成する", style=discord.ButtonStyle.success, custom_id="create_temp_vc_btn", emoji="🔒")
     async def create_vc_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         bot = interaction.client
-        prices = {}
-        async with bot.get_db() as db:
-            async with db.execute("SELECT key, value FROM server_config WHERE key IN ('vc_price_6', 'vc_price_12', 'vc_price_24')") as cursor:
-                rows = await cursor.fetchall()
-                for row in rows:
-                    prices[row['key'].replace('vc_price_', '')] = int(row['value'])
-
-        if '6'  not in prices: prices['6']  = 30000
-        if '12' not in prices: prices['12'] = 50000
-        if '24' not in prices: prices['24'] = 80000
-
         view = discord.ui.View()
-        view.add_item(PlanSelect(prices))
+        view.add_item(PlanSelect(bot.config.vc_prices))
         await interaction.response.send_message("利用する時間プランを選択してください。", view=view, ephemeral=True)
 
 
@@ -731,33 +1083,36 @@ class PrivateVCManager(commands.Cog):
 
     @tasks.loop(minutes=1)
     async def check_expiration_task(self):
-        now = datetime.datetime.now()
+        now = int(time.time())
         try:
+            # 期限切れの行だけを索引(idx_temp_vc_expire)で拾う
+            async with self.bot.get_db(readonly=True) as db:
+                expired = await db.execute_fetchall("SELECT channel_id FROM temp_vcs WHERE expire_at <= ?", (now,))
+
+            if not expired: return
+
+            for row in expired:
+                channel = self.bot.get_channel(row['channel_id'])
+                if channel is not None:
+                    try:
+                        await channel.delete(reason="Temp VC Expired")
+                    except: pass
+
             async with self.bot.get_db() as db:
-                async with db.execute("SELECT channel_id, guild_id FROM temp_vcs") as cursor:
-                    all_vcs = await cursor.fetchall()
-
-                if not all_vcs: return
-
-                for row in all_vcs:
-                    c_id = row['channel_id']
-                    channel = self.bot.get_channel(c_id)
-                    if channel is None:
-                        await db.execute("DELETE FROM temp_vcs WHERE channel_id = ?", (c_id,))
-                    else:
-                        async with db.execute("SELECT expire_at FROM temp_vcs WHERE channel_id = ?", (c_id,)) as c:
-                            rec = await c.fetchone()
-                        if rec:
-                            expire_at = datetime.datetime.fromisoformat(str(rec['expire_at']))
-                            if now >= expire_at:
-                                try:
-                                    await channel.delete(reason="Temp VC Expired")
-                                except: pass
-                                await db.execute("DELETE FROM temp_vcs WHERE channel_id = ?", (c_id,))
+                await db.execute("DELETE FROM temp_vcs WHERE expire_at <= ?", (now,))
+                await db.commit()
+        except Exception as e:
+            logger.error("Expiration Check Error: %s", e)
 
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        # 手動で消されたVCの行は、毎分の全件走査ではなく削除イベントで片付ける
+        try:
+            async with self.bot.get_db() as db:
+                await db.execute("DELETE FROM temp_vcs WHERE channel_id = ?", (channel.id,))
                 await db.commit()
         except Exception as e:
-            logger.error(f"Expiration Check Error: {e}")
+            logger.error("Temp VC Cleanup Error: %s", e)
 
     @check_expiration_task.before_loop
     async def before_check(self):
@@ -784,23 +1139,18 @@ class PrivateVCManager(commands.Cog):
         await interaction.response.defer(ephemeral=True)
 
         if description is None:
-            description = (
-                "権限のある人以外からは見えない、プライベートな一時VCを作成できます。ようこそアパホテルへ\n\n"
-                "**🔒 プライバシー**\n招待した人以外は見えません\n"
-                "**🛡 料金システム**\n作成時に自動引き落とし\n"
-                f"**⏰ 料金プラン**\n"
-                f"• **6時間**: {price_6h:,} Stell\n"
-                f"• **12時間**: {price_12h:,} Stell\n"
-                f"• **24時間**: {price_24h:,} Stell"
-            )
+            description = _panel_desc(price_6h, price_12h, price_24h, False)
         else:
             description = description.replace("\\n", "\n")
 
         async with self.bot.get_db() as db:
-            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('vc_price_6', ?)",  (str(price_6h),))
-            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('vc_price_12', ?)", (str(price_12h),))
-            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('vc_price_24', ?)", (str(price_24h),))
+            await db.executemany("INSERT OR REPLACE INTO server_config (key, value) VALUES (?, ?)", [
+                ('vc_price_6',  str(price_6h)),
+                ('vc_price_12', str(price_12h)),
+                ('vc_price_24', str(price_24h)),
+            ])
             await db.commit()
+        await self.bot.config.reload()
 
         embed = discord.Embed(title=title, description=description, color=Color.DARK)
         embed.set_footer(text=f"Last Updated: {datetime.datetime.now().strftime('%Y/%m/%d %H:%M')}")
@@ -820,15 +1170,12 @@ class PrivateVCManager(commands.Cog):
     async def config_public_vc_exclude(self, interaction: discord.Interaction, action: str, role: Optional[discord.Role] = None):
         await interaction.response.defer(ephemeral=True)
 
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT value FROM server_config WHERE key = 'public_vc_exclude_roles'") as c:
-                row = await c.fetchone()
-            current = row['value'].split(',') if row and row['value'] else []
+        current = set(self.bot.config.public_vc_exclude_role_ids)
 
         if action == "list":
             if not current:
                 return await interaction.followup.send("除外ロールは設定されていません。", ephemeral=True)
-            mentions = "\n".join(f"<@&{r}>" for r in current if r)
+            mentions = "\n".join(f"<@&{r}>" for r in sorted(current))
             embed = discord.Embed(title="🚫 公開VC除外ロール一覧", description=mentions, color=Color.DANGER)
             return await interaction.followup.send(embed=embed, ephemeral=True)
 
@@ -836,19 +1183,20 @@ class PrivateVCManager(commands.Cog):
             return await interaction.followup.send("❌ ロールを指定してください。", ephemeral=True)
 
         if action == "add":
-            if str(role.id) in current:
+            if role.id in current:
                 return await interaction.followup.send(f"⚠️ {role.mention} は既に登録されています。", ephemeral=True)
-            current.append(str(role.id))
+            current.add(role.id)
             msg = f"✅ {role.mention} を除外ロールに追加しました。"
         else:
-            if str(role.id) not in current:
+            if role.id not in current:
                 return await interaction.followup.send(f"⚠️ {role.mention} は登録されていません。", ephemeral=True)
-            current.remove(str(role.id))
+            current.discard(role.id)
             msg = f"🗑️ {role.mention} を除外ロールから削除しました。"
 
         async with self.bot.get_db() as db:
-            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('public_vc_exclude_roles', ?)", (','.join(current),))
+            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('public_vc_exclude_roles', ?)", (','.join(map(str, sorted(current))),))
             await db.commit()
+        await self.bot.config.reload()
 
         await interaction.followup.send(msg, ephemeral=True)
 
@@ -874,23 +1222,18 @@ class PrivateVCManager(commands.Cog):
         await interaction.response.defer(ephemeral=True)
 
         if description is None:
-            description = (
-                "誰でも入れる公開一時VCを作成できます。\n\n"
-                "**🔓 公開ルーム**\n設定された一部のロールを除き誰でも参加できます\n"
-                "**🛡 料金システム**\n作成時に自動引き落とし\n"
-                f"**⏰ 料金プラン**\n"
-                f"• **6時間**: {price_6h:,} Stell\n"
-                f"• **12時間**: {price_12h:,} Stell\n"
-                f"• **24時間**: {price_24h:,} Stell"
-            )
+            description = _panel_desc(price_6h, price_12h, price_24h, True)
         else:
             description = description.replace("\\n", "\n")
 
         async with self.bot.get_db() as db:
-            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('public_vc_price_6', ?)",  (str(price_6h),))
-            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('public_vc_price_12', ?)", (str(price_12h),))
-            await db.execute("INSERT OR REPLACE INTO server_config (key, value) VALUES ('public_vc_price_24', ?)", (str(price_24h),))
+            await db.executemany("INSERT OR REPLACE INTO server_config (key, value) VALUES (?, ?)", [
+                ('public_vc_price_6',  str(price_6h)),
+                ('public_vc_price_12', str(price_12h)),
+                ('public_vc_price_24', str(price_24h)),
+            ])
             await db.commit()
+        await self.bot.config.reload()
 
         embed = discord.Embed(title=title, description=description, color=Color.DARK)
         embed.set_footer(text=f"Last Updated: {datetime.datetime.now().strftime('%Y/%m/%d %H:%M')}")
@@ -928,75 +1271,76 @@ class TransferConfirmView(discord.ui.View):
 
         await interaction.response.defer()
         
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
+        now = datetime.datetime.now()
+        month_tag = _month_tag()
         sender_new_bal = 0
         receiver_new_bal = 0
 
         async with self.bot.get_db() as db:
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (self.sender.id,)) as c:
-                row = await c.fetchone()
-                if not row or row['balance'] < self.amount:
-                    return await interaction.followup.send("❌ 残高が不足しています。", ephemeral=True)
+            # 残高確認と引き落としを1文で行い、引き落とし後の残高をそのまま受け取る
+            row = await fetchone(db, SQL_TRY_DEBIT_RETURNING, (self.amount, self.sender.id, self.amount))
+            if row is None:
+                # 0行更新でも書き込みトランザクションは開いているので、返信を待つ前に閉じる
+                await db.rollback()
+                return await interaction.followup.send("❌ 残高が不足しています。", ephemeral=True)
+            sender_new_bal = row['balance']
 
             try:
-                await db.execute("UPDATE accounts SET balance = balance - ? WHERE user_id = ?", (self.amount, self.sender.id))
-                
-                await db.execute("""
-                    INSERT INTO accounts (user_id, balance, total_earned) VALUES (?, ?, 0)
-                    ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance
-                """, (self.receiver.id, self.amount))
-                
-                await db.execute("""
-                    INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag)
-                    VALUES (?, ?, ?, 'TRANSFER', ?, ?)
-                """, (self.sender.id, self.receiver.id, self.amount, self.msg, month_tag))
-                
-                async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (self.sender.id,)) as c:
-                    sender_new_bal = (await c.fetchone())['balance']
-                async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (self.receiver.id,)) as c:
-                    receiver_new_bal = (await c.fetchone())['balance']
+                row = await fetchone(db, SQL_CREDIT_UPSERT_RETURNING, (self.receiver.id, self.amount))
+                receiver_new_bal = row['balance']
 
+                await db.execute(SQL_INSERT_TX, (self.sender.id, self.receiver.id, self.amount, 'TRANSFER', self.msg, month_tag))
                 await db.commit()
                 
-                self.stop()
-                await interaction.edit_original_response(content=f"✅ {self.receiver.mention} へ {self.amount:,} Stell 送金しました。", embed=None, view=None)
+            except Exception as e:
+                await db.rollback()
+                return await interaction.followup.send(f"❌ エラーが発生しました: {e}", ephemeral=True)
 
-                try:
-                    notify = True
-                    async with db.execute("SELECT dm_salary_enabled FROM user_settings WHERE user_id = ?", (self.receiver.id,)) as c:
-                        res = await c.fetchone()
-                        if res and res['dm_salary_enabled'] == 0: notify = False
-                    
-                    if notify:
-                        embed = discord.Embed(title="💰 Stell受取通知", color=Color.SUCCESS)
-                        embed.add_field(name="送金者", value=self.sender.mention, inline=False)
-                        embed.add_field(name="受取額", value=f"**{self.amount:,} Stell**", inline=False)
-                        embed.add_field(name="メッセージ", value=f"`{self.msg}`", inline=False)
-                        embed.timestamp = datetime.datetime.now()
-                        await self.receiver.send(embed=embed)
-                except:
-                    pass
+        self.stop()
+        await interaction.edit_original_response(content=f"✅ {self.receiver.mention} へ {self.amount:,} Stell 送金しました。", embed=None, view=None)
+        # 受取通知とログ送信は送金者への応答を待たせないよう裏で行う
+        spawn(self._post_transfer_notify(sender_new_bal, receiver_new_bal, now))
 
-                log_ch_id = None
-                async with db.execute("SELECT value FROM server_config WHERE key = 'currency_log_id'") as c:
-                    row = await c.fetchone()
-                    if row: log_ch_id = int(row['value'])
-                
-                if log_ch_id:
-                    channel = self.bot.get_channel(log_ch_id)
-                    if channel:
-                        now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        log_embed = discord.Embed(title="💸 送金ログ", color=Color.STELL)
-                        log_embed.description = f"{self.sender.mention} ➔ {self.receiver.mention}"
-                        log_embed.add_field(name="金額", value=f"**{self.amount:,} Stell**", inline=True)
-                        log_embed.add_field(name="備考", value=self.msg, inline=True)
-                        log_embed.add_field(name="処理後残高", value=f"送: {sender_new_bal:,} Stell\n受: {receiver_new_bal:,} Stell", inline=False)
-                        log_embed.set_footer(text=f"Time: {now_str}")
-                        await channel.send(embed=log_embed)
+    async def _post_transfer_notify(self, sender_new_bal: int, receiver_new_bal: int, now: datetime.datetime):
+        # Embed() + add_field を繰り返さず、送信時の形の dict を1回で組み立てる
+        try:
+            async with self.bot.get_db(readonly=True) as db:
+                res = await fetchone(db, SQL_DM_PREF, (self.receiver.id,))
+            if not (res and res['dm_salary_enabled'] == 0):
+                embed = discord.Embed.from_dict({
+                    "title": "💰 Stell受取通知",
+                    "color": Color.SUCCESS,
+                    "timestamp": now.astimezone().isoformat(),
+                    "fields": [
+                        {"name": "送金者",     "value": self.sender.mention,        "inline": False},
+                        {"name": "受取額",     "value": f"**{self.amount:,} Stell**", "inline": False},
+                        {"name": "メッセージ", "value": f"`{self.msg}`",              "inline": False},
+                    ],
+                })
+                await self.receiver.send(embed=embed)
+        except:
+            pass
 
-            except Exception as e:
-                await db.rollback()
-                await interaction.followup.send(f"❌ エラーが発生しました: {e}", ephemeral=True)
+        log_ch_id = self.bot.config.log_channel_ids.get('currency_log_id')
+        if log_ch_id:
+            channel = self.bot.get_channel(log_ch_id)
+            if channel:
+                log_embed = discord.Embed.from_dict({
+                    "title": "💸 送金ログ",
+                    "color": Color.STELL,
+                    "description": f"{self.sender.mention} ➔ {self.receiver.mention}",
+                    "fields": [
+                        {"name": "金額",       "value": f"**{self.amount:,} Stell**", "inline": True},
+                        {"name": "備考",       "value": self.msg,                     "inline": True},
+                        {"name": "処理後残高", "value": f"送: {sender_new_bal:,} Stell\n受: {receiver_new_bal:,} Stell", "inline": False},
+                    ],
+                    "footer": {"text": f"Time: {now:%Y-%m-%d %H:%M:%S}"},
+                })
+                # 裏のタスクなので、ここで握らないと例外が誰にも拾われない
+                try:
+                    await channel.send(embed=log_embed)
+                except Exception as e:
+                    logger.error("Log Send Error (currency_log_id): %s", e)
 
     @discord.ui.button(label="❌ キャンセル", style=discord.ButtonStyle.grey)
     async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -1009,6 +1353,24 @@ class TransferConfirmView(discord.ui.View):
         self.stop()
         await interaction.response.edit_message(content="❌ 送金をキャンセルしました。", embed=None, view=None)
 
+# ゴミ拾いの抽選表（累積確率と、(金額の決め方, メッセージ)）
+_GOMI_CUM = (
+    0.001,  # 釈迦から特別（0.1%）
+    0.011,  # 涅槃（1%）
+    0.091,  # 煩悩（8%）
+    0.141,  # 釈迦の財布（5%）
+    0.291,  # お賽銭（15%）
+    1.0,    # 通常（70.9%）
+)
+_GOMI_OUTCOMES = (
+    (lambda: 10000,                      "✨ 釈迦「**特別やで**」\n**10,000 Stell** もらった！"),
+    (lambda: 0,                          "🪷 涅槃に達した…お金への執着を手放した。\n**(+0 Stell)**"),
+    (lambda: -random.randint(100, 300),  "😩 煩悩を拾ってしまった…108の苦しみ。\n**{gain:,} Stell**"),
+    (lambda: random.randint(2000, 5000), "👛 釈迦の財布を発見！功徳が積まれた！\n**+{gain:,} Stell**"),
+    (lambda: random.randint(50, 200),    "🪙 お賽銭を拾った…ありがたや。\n**+{gain:,} Stell**"),
+    (lambda: random.randint(500, 1000),  "🗑️ ゴミを拾って **+{gain:,} Stell** 稼いだ！"),
+)
+
 # ── Cog: Economy (残高・送金・ランキング・資金操作) ──
 class Economy(commands.Cog):
     def __init__(self, bot):
@@ -1029,8 +1391,8 @@ class Economy(commands.Cog):
             if not await self.check_admin_permission(interaction.user):
                 return await interaction.followup.send("❌ 他人の口座を参照する権限がありません。", ephemeral=True)
 
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (target.id,)) as cursor:
+        async with self.bot.get_db(readonly=True) as db:
+            async with db.execute(SQL_GET_BALANCE, (target.id,)) as cursor:
                 row = await cursor.fetchone()
                 bal = row['balance'] if row else 0
         
@@ -1061,10 +1423,16 @@ class Economy(commands.Cog):
     @app_commands.command(name="履歴", description="直近10件の入出金履歴を表示します")
     async def history(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        async with self.bot.get_db() as db:
-            query = "SELECT * FROM transactions WHERE sender_id = ? OR receiver_id = ? ORDER BY created_at DESC LIMIT 10"
-            async with db.execute(query, (interaction.user.id, interaction.user.id)) as cursor:
-                rows = await cursor.fetchall()
+        async with self.bot.get_db(readonly=True) as db:
+            # 送金側・受取側それぞれの索引から新しい10件ずつを取り、合わせて上位10件にする
+            # （OR のままだと該当行を全部集めてから並べ替えることになる）
+            query = """
+                SELECT * FROM (SELECT * FROM transactions WHERE sender_id = :uid ORDER BY created_at DESC LIMIT 10)
+                UNION
+                SELECT * FROM (SELECT * FROM transactions WHERE receiver_id = :uid ORDER BY created_at DESC LIMIT 10)
+                ORDER BY created_at DESC LIMIT 10
+            """
+            rows = await db.execute_fetchall(query, {"uid": interaction.user.id})
         
         if not rows: return await interaction.followup.send("取引履歴はありません。", ephemeral=True)
 
@@ -1087,37 +1455,25 @@ class Economy(commands.Cog):
     @app_commands.command(name="今日の残り回数", description="今日のギャンブル残り回数を確認します")
     async def check_remaining(self, interaction: discord.Interaction):
         user_id = interaction.user.id
-        today   = datetime.datetime.now().strftime("%Y-%m-%d")
+        now     = datetime.datetime.now()
+        today   = _day_tag(now)
 
         bj_limit        = await _cfg(self.bot, "slot_daily_limit")
         chinchiro_limit = await _cfg(self.bot, "chinchiro_daily_limit")
 
-        async with self.bot.get_db() as db:
-            async with db.execute(
-                "SELECT count FROM daily_play_counts WHERE user_id=? AND game='blackjack' AND date=?",
-                (user_id, today)
-            ) as c:
-                row = await c.fetchone()
-            bj_count = row["count"] if row else 0
-
-            async with db.execute(
-                "SELECT 1 FROM daily_play_exemptions WHERE user_id=? AND game='blackjack' AND date=?",
-                (user_id, today)
-            ) as c:
-                bj_exempt = bool(await c.fetchone())
-
-            async with db.execute(
-                "SELECT count FROM daily_play_counts WHERE user_id=? AND game='chinchiro' AND date=?",
-                (user_id, today)
-            ) as c:
-                row = await c.fetchone()
-            chinchiro_count = row["count"] if row else 0
-
-            async with db.execute(
-                "SELECT 1 FROM daily_play_exemptions WHERE user_id=? AND game='chinchiro' AND date=?",
-                (user_id, today)
-            ) as c:
-                chinchiro_exempt = bool(await c.fetchone())
+        # 2ゲーム分の回数と制限解除の有無を1回のクエリで取得
+        async with self.bot.get_db(readonly=True) as db:
+            rows = await db.execute_fetchall("""
+                SELECT g.column1 AS game,
+                       COALESCE((SELECT count FROM daily_play_counts
+                                  WHERE user_id = :uid AND game = g.column1 AND date = :today), 0) AS count,
+                       EXISTS(SELECT 1 FROM daily_play_exemptions
+                               WHERE user_id = :uid AND game = g.column1 AND date = :today) AS exempt
+                  FROM (VALUES ('blackjack'), ('chinchiro')) AS g
+            """, {"uid": user_id, "today": today})
+        status = {r["game"]: (r["count"], bool(r["exempt"])) for r in rows}
+        bj_count, bj_exempt               = status["blackjack"]
+        chinchiro_count, chinchiro_exempt = status["chinchiro"]
 
         embed = discord.Embed(title="🎲 本日のギャンブル残り回数", color=Color.DARK)
         embed.add_field(
@@ -1137,98 +1493,66 @@ class Economy(commands.Cog):
     @app_commands.command(name="ゴミ拾い", description="ゴミを拾ってStellを稼ぎます（残高500以下限定・1日30回まで）")
     async def gomi_hiroi(self, interaction: discord.Interaction):
         user_id = interaction.user.id
-        today   = datetime.datetime.now().strftime("%Y-%m-%d")
+        now     = datetime.datetime.now()
+        today   = _day_tag(now)
 
         async with self.bot.get_db() as db:
-            # 残高チェック
-            async with db.execute(
-                "SELECT balance FROM accounts WHERE user_id = ?", (user_id,)
-            ) as c:
-                row = await c.fetchone()
-            bal = row["balance"] if row else 0
-
-            if bal > 500:
-                return await interaction.response.send_message(
-                    "❌ 残高が500 Stellを超えているのでゴミ拾いはできません。",
-                    ephemeral=True
-                )
+            # 確認から書き込みまでを1つのトランザクションに（連打で上限を超えないように）
+            await db.execute("BEGIN IMMEDIATE")
 
             # 日次上限チェック
-            async with db.execute(
-                "SELECT count FROM daily_play_counts WHERE user_id=? AND game='gomi' AND date=?",
-                (user_id, today)
-            ) as c:
-                row = await c.fetchone()
+            row = await fetchone(
+                db,
+                SQL_DAILY_COUNT,
+                (user_id, 'gomi', today)
+            )
             count = row["count"] if row else 0
 
             if count >= 30:
+                await db.rollback()
                 return await interaction.response.send_message(
                     "🚫 今日のゴミ拾いは上限（30回）に達しました。また明日ね。",
                     ephemeral=True
                 )
 
-            # イースターエッグ抽選
-            roll = random.random() * 100
-            if roll < 0.1:
-                # 釈迦から特別（0.1%）
-                amount  = 10000
-                gain    = amount
-                message = "✨ 釈迦「**特別やで**」\n**10,000 Stell** もらった！"
-            elif roll < 1.1:
-                # 涅槃（1%）
-                amount  = 0
-                gain    = 0
-                message = "🪷 涅槃に達した…お金への執着を手放した。\n**(+0 Stell)**"
-            elif roll < 9.1:
-                # 煩悩（8%）
-                amount  = -random.randint(100, 300)
-                gain    = max(amount, -bal)  # マイナスにならないよう調整
-                message = f"😩 煩悩を拾ってしまった…108の苦しみ。\n**{gain:,} Stell**"
-            elif roll < 14.1:
-                # お賽銭（5%）
-                amount  = random.randint(2000, 5000)
-                gain    = amount
-                message = f"👛 釈迦の財布を発見！功徳が積まれた！\n**+{gain:,} Stell**"
-            elif roll < 29.1:
-                # お賽銭（15%）
-                amount  = random.randint(50, 200)
-                gain    = amount
-                message = f"🪙 お賽銭を拾った…ありがたや。\n**+{gain:,} Stell**"
-            else:
-                # 通常（76.9%）
-                amount  = random.randint(500, 1000)
-                gain    = amount
-                message = f"🗑️ ゴミを拾って **+{gain:,} Stell** 稼いだ！"
-
-            # 残高反映
-            if gain != 0:
-                await db.execute("""
-                    INSERT INTO accounts (user_id, balance, total_earned) VALUES (?, MAX(0, ?), MAX(0, ?))
-                    ON CONFLICT(user_id) DO UPDATE SET
-                        balance      = MAX(0, balance + ?),
-                        total_earned = total_earned + MAX(0, ?)
-                """, (user_id, gain, max(gain, 0), gain, max(gain, 0)))
-
-                month_tag = datetime.datetime.now().strftime("%Y-%m")
-                if gain > 0:
-                    await db.execute("""
-                        INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag)
-                        VALUES (0, ?, ?, 'GOMI', 'ゴミ拾い', ?)
-                    """, (user_id, gain, month_tag))
-                else:
-                    await db.execute("""
-                        INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag)
-                        VALUES (?, 0, ?, 'GOMI', 'ゴミ拾い（煩悩）', ?)
-                    """, (user_id, abs(gain), month_tag))
+            # イースターエッグ抽選（累積確率表を二分探索して結果を1回で引く）
+            amount_fn, template = _GOMI_OUTCOMES[bisect.bisect_right(_GOMI_CUM, random.random())]
+            gain = amount_fn()
+            if gain < 0:
+                # マイナスにならないよう、減る時だけ今の残高で上限をかける
+                row  = await fetchone(db, SQL_GET_BALANCE, (user_id,))
+                gain = max(gain, -(row["balance"] if row else 0))
+
+            # 残高条件（500以下）の確認と残高反映を1文で。行が返らなければ条件を満たしていない
+            row = await fetchone(db, """
+                INSERT INTO accounts (user_id, balance, total_earned) VALUES (:uid, MAX(0, :gain), MAX(0, :gain))
+                ON CONFLICT(user_id) DO UPDATE SET
+                    balance      = MAX(0, balance + :gain),
+                    total_earned = total_earned + MAX(0, :gain)
+                WHERE accounts.balance <= 500
+                RETURNING balance
+            """, {"uid": user_id, "gain": gain})
+
+            if row is None:
+                await db.rollback()
+                return await interaction.response.send_message(
+                    "❌ 残高が500 Stellを超えているのでゴミ拾いはできません。",
+                    ephemeral=True
+                )
+            new_bal = row["balance"]
+            message = template.format(gain=gain)
 
-            await db.execute("""
-                INSERT INTO daily_play_counts (user_id, game, date, count) VALUES (?, 'gomi', ?, 1)
-                ON CONFLICT(user_id, game, date) DO UPDATE SET count = count + 1
-            """, (user_id, today))
+            await db.execute(SQL_BUMP_DAILY_COUNT, (user_id, 'gomi', today))
 
             await db.commit()
 
-        new_bal = max(0, bal + gain)
+        if gain != 0:
+            month_tag = _month_tag()
+            if gain > 0:
+                self.bot.db_manager.log_transaction(0, user_id, gain, 'GOMI', 'ゴミ拾い', month_tag)
+            else:
+                self.bot.db_manager.log_transaction(user_id, 0, abs(gain), 'GOMI', 'ゴミ拾い（煩悩）', month_tag)
+
         remaining = 29 - count
         await interaction.response.send_message(
             f"{message}\n"
@@ -1241,29 +1565,30 @@ class Economy(commands.Cog):
     async def ranking(self, interaction: discord.Interaction):
         await interaction.response.defer()
         
-        async with self.bot.get_db() as db:
-            # システムアカウント(ID:0)を除外し、残高が多い順に取得 (退出者やBotを飛ばせるように少し多めに取得)
-            async with db.execute("SELECT user_id, balance FROM accounts WHERE user_id != 0 ORDER BY balance DESC LIMIT 30") as cursor:
-                rows = await cursor.fetchall()
-
-        if not rows:
+        guild = interaction.guild
+        top = []
+        async with self.bot.get_db(readonly=True) as db:
+            # システムアカウント(ID:0)を除外し、残高の索引順に少しずつ読む
+            # 退出済みのメンバーやBotを飛ばしながら、10人揃った時点で読むのをやめる
+            async with db.execute("SELECT user_id, balance FROM accounts WHERE user_id != 0 ORDER BY balance DESC") as cursor:
+                while len(top) < 10:
+                    rows = await cursor.fetchmany(16)
+                    if not rows: break
+                    for row in rows:
+                        member = guild.get_member(row['user_id'])
+                        if member and not member.bot:
+                            top.append((member, row['balance']))
+                            if len(top) == 10: break
+
+        if not top:
             return await interaction.followup.send("まだデータがありません。")
 
         embed = discord.Embed(title="🏆 ステラ長者番付 トップ10", color=Color.STELL)
         embed.description = "サーバー内の大富豪ランキングです。\n\n"
         
-        rank = 1
-        for row in rows:
-            if rank > 10: break
-            
-            member = interaction.guild.get_member(row['user_id'])
-            # 退出済みのメンバーやBotはランキングから除外
-            if not member or member.bot:
-                continue
-            
+        for rank, (member, balance) in enumerate(top, 1):
             medal = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"**{rank}.**"
-            embed.description += f"{medal} **{member.display_name}**\n┗ 💰 **{row['balance']:,} Stell**\n\n"
-            rank += 1
+            embed.description += f"{medal} **{member.display_name}**\n┗ 💰 **{balance:,} Stell**\n\n"
 
         embed.set_footer(text=f"実行者: {interaction.user.display_name} | Top 10 Richest Citizens")
         await interaction.followup.send(embed=embed)
@@ -1286,7 +1611,8 @@ class Economy(commands.Cog):
             return await interaction.response.send_message("❌ 1以上の金額を指定してください。", ephemeral=True)
         
         await interaction.response.defer(ephemeral=True)
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
+        now = datetime.datetime.now()
+        month_tag = _month_tag()
 
         async with self.bot.get_db() as db:
             await db.execute("""
@@ -1303,60 +1629,38 @@ class Economy(commands.Cog):
                 msg = f"✅ {target.mention} に **{amount:,} Stell** を付与しました。\n理由: `{reason}`"
             
             else:
-                async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (target.id,)) as c:
-                    row = await c.fetchone()
-                    current_bal = row['balance'] if row else 0
-                
-                actual_deduction = min(amount, current_bal)
-                
-                await db.execute("UPDATE accounts SET balance = balance - ? WHERE user_id = ?", (actual_deduction, target.id))
+                # 足りる場合は1文で引き落とす。足りない時だけ残高を読んで全額没収する
+                # （書き込み接続は BEGIN IMMEDIATE なので、読んでから引くまでに割り込まれない）
+                if await fetchone(db, SQL_TRY_DEBIT_RETURNING, (amount, target.id, amount)):
+                    actual_deduction = amount
+                else:
+                    row = await fetchone(db, SQL_GET_BALANCE, (target.id,))
+                    actual_deduction = row['balance'] if row else 0
+                    await db.execute(SQL_DEBIT, (actual_deduction, target.id))
                 await db.execute("""
                     INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag)
                     VALUES (?, 0, ?, 'SYSTEM_REMOVE', ?, ?)
                 """, (target.id, actual_deduction, f"【運営没収】{reason}", month_tag))
                 msg = f"✅ {target.mention} から **{actual_deduction:,} Stell** を没収しました。\n理由: `{reason}`"
 
-            # ここを追加 ↓
-            async with db.execute("SELECT value FROM server_config WHERE key = 'currency_log_id'") as c:
-                row = await c.fetchone()
-                log_ch_id = int(row['value']) if row else None
-
             await db.commit()
 
-        embed = discord.Embed(title="⚙️ 運営資金操作ログ", color=Color.DANGER if action == "remove" else 0x00ff00)
-        embed.add_field(name="対象", value=target.mention, inline=True)
-        embed.add_field(name="操作", value="➕ 付与" if action == "add" else "➖ 没収", inline=True)
-        embed.add_field(name="金額", value=f"**{amount:,} S**" if action == "add" else f"**{actual_deduction:,} S**", inline=True)
-        embed.add_field(name="理由", value=reason, inline=False)
-        embed.add_field(name="実行者", value=interaction.user.mention, inline=False)
-        embed.timestamp = datetime.datetime.now()
+        await interaction.followup.send(msg, ephemeral=True)
 
-        # ここを削除 ↓（元の2回目のget_dbブロックをこれに置き換え）
-        if log_ch_id:
-            channel = self.bot.get_channel(log_ch_id)
-            if channel: await channel.send(embed=embed)
+        log_ch_id = self.bot.config.log_channel_ids.get('currency_log_id')
+        channel = self.bot.get_channel(log_ch_id) if log_ch_id else None
+        if not channel:
+            return
 
-        await interaction.followup.send(msg, ephemeral=True)
-            
-        # 通貨ログチャンネルに通知を送る
         embed = discord.Embed(title="⚙️ 運営資金操作ログ", color=Color.DANGER if action == "remove" else 0x00ff00)
         embed.add_field(name="対象", value=target.mention, inline=True)
         embed.add_field(name="操作", value="➕ 付与" if action == "add" else "➖ 没収", inline=True)
         embed.add_field(name="金額", value=f"**{amount:,} S**" if action == "add" else f"**{actual_deduction:,} S**", inline=True)
         embed.add_field(name="理由", value=reason, inline=False)
         embed.add_field(name="実行者", value=interaction.user.mention, inline=False)
-        embed.timestamp = datetime.datetime.now()
-
-        log_ch_id = None
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT value FROM server_config WHERE key = 'currency_log_id'") as c:
-                row = await c.fetchone()
-                if row: log_ch_id = int(row['value'])
-        if log_ch_id:
-            channel = self.bot.get_channel(log_ch_id)
-            if channel: await channel.send(embed=embed)
-
-        await interaction.followup.send(msg, ephemeral=True)
+        embed.timestamp = now
+        # send_bank_log は送信失敗をログに残すので、裏で投げっぱなしにしても例外が迷子にならない
+        spawn(self.bot.send_bank_log('currency_log_id', embed))
 
     async def check_admin_permission(self, user):
         if await self.bot.is_owner(user): return True
@@ -1369,8 +1673,21 @@ class Economy(commands.Cog):
 
 
 class Salary(commands.Cog):
+    DM_PREF_CACHE_TTL = 300.0
+
     def __init__(self, bot):
         self.bot = bot
+        # DM通知設定のキャッシュ（toggle_dm で書き換え、TTL切れで読み直す）
+        self._dm_pref_cache: Optional[Dict[int, bool]] = None
+        self._dm_pref_expiry = 0.0
+
+    async def _get_dm_prefs(self) -> Dict[int, bool]:
+        if self._dm_pref_cache is None or time.monotonic() >= self._dm_pref_expiry:
+            async with self.bot.get_db(readonly=True) as db:
+                rows = await db.execute_fetchall("SELECT user_id, dm_salary_enabled FROM user_settings")
+            self._dm_pref_cache = {int(r['user_id']): bool(r['dm_salary_enabled']) for r in rows}
+            self._dm_pref_expiry = time.monotonic() + self.DM_PREF_CACHE_TTL
+        return self._dm_pref_cache
 
     @app_commands.command(name="通貨通知設定", description="通貨交換時のDM明細通知をON/OFFします")
     @app_commands.describe(status="ON: 通知を受け取る / OFF: 通知しない")
@@ -1386,6 +1703,8 @@ class Salary(commands.Cog):
                 ON CONFLICT(user_id) DO UPDATE SET dm_salary_enabled = excluded.dm_salary_enabled
             """, (interaction.user.id, status))
             await db.commit()
+        if self._dm_pref_cache is not None:
+            self._dm_pref_cache[interaction.user.id] = bool(status)
         
         msg = "✅ 今後、お金の明細は **DMで通知されます**。" if status == 1 else "🔕 今後、給与明細の **DM通知は行われません**。"
         await interaction.response.send_message(msg, ephemeral=True)
@@ -1397,79 +1716,108 @@ class Salary(commands.Cog):
         await interaction.response.defer()
         
         now = datetime.datetime.now()
-        month_tag = now.strftime("%Y-%m")
+        month_tag = _month_tag()
         batch_id = str(uuid.uuid4())[:8]
         
         # ── 1. データ準備 ──
-        wage_dict = {}
-        dm_prefs = {}
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT role_id, amount FROM role_wages") as c:
-                async for r in c: wage_dict[int(r['role_id'])] = int(r['amount'])
-            async with db.execute("SELECT user_id, dm_salary_enabled FROM user_settings") as c:
-                async for r in c: dm_prefs[int(r['user_id'])] = bool(r['dm_salary_enabled'])
+        # 給与表は ConfigManager が保持している（給与額設定のたびに reload される）
+        wage_dict = self.bot.config.role_wages
+        dm_prefs = await self._get_dm_prefs()
 
         if not wage_dict:
             return await interaction.followup.send("⚠️ 給与設定が見つかりません。")
         
-        # メンバーリスト取得
-        members = interaction.guild.members if interaction.guild.chunked else [m async for m in interaction.guild.fetch_members()]
+        # メンバーリスト取得（未取得ならREST のページ送りではなくゲートウェイで一括取得してキャッシュする）
+        if not interaction.guild.chunked:
+            await interaction.guild.chunk(cache=True)
+        members = interaction.guild.members
 
         # ── 2. 計算処理（メモリ上で処理） ──
         count = 0
         total_payout = 0
-        role_summary = {}
+        # role_id -> [人数, 金額, メンション]
+        role_summary = defaultdict(lambda: [0, 0, None])
         payout_data_list = []
+        # 明細の文字列部分は同じロール構成の人で使い回す
+        slip_parts = {}
 
-        # DB一括書き込み用のリスト
-        account_updates = []
-        transaction_inserts = []
+        # DB一括書き込み用のリスト (user_id, 支給額)
+        payroll = []
+
+        # ループ内で使う参照はローカルに持っておく
+        wage_get = wage_dict.__getitem__
+        wage_id_set = frozenset(wage_dict)
+        get_role = interaction.guild.get_role
+        # member._roles には @everyone（IDはサーバーIDと同じ）が入っていないので別に足す
+        everyone_id = interaction.guild.id
+        everyone_hit = frozenset((everyone_id,)) if everyone_id in wage_id_set else None
 
         for member in members:
             if member.bot: continue
             
-            matching = [(wage_dict[r.id], r) for r in member.roles if r.id in wage_dict]
+            # Role オブジェクトを作らずにロールIDの集合だけで給与対象かを判定する（大半はここで落ちる）
+            hits = wage_id_set.intersection(member._roles)
+            if everyone_hit:
+                hits = hits | everyone_hit
+            if not hits: continue
+
+            matching = [(wage_get(rid), r) for rid in hits if (r := get_role(rid))]
             if not matching: continue
+            if len(matching) > 1:
+                matching.sort(key=lambda x: x[1])  # member.roles と同じ並び（ロールの位置順）に揃える
             
             member_total = sum(w for w, _ in matching)
             
-            # DB書き込み用データをリストに追加 (SQLのパラメータ順に合わせる)
-            # accounts: user_id, balance, total_earned
-            account_updates.append((member.id, member_total, member_total))
-            
-            # transactions: sender, receiver, amount, type, batch_id, month, desc
-            transaction_inserts.append((
-                0, member.id, member_total, 'SALARY', batch_id, month_tag, f"{month_tag} 給与"
-            ))
+            payroll.append((member.id, member_total))
 
             count += 1
             total_payout += member_total
             
             # 集計用ロジック
             for w, r in matching:
-                if r.id not in role_summary: role_summary[r.id] = {"mention": r.mention, "count": 0, "amount": 0}
-                role_summary[r.id]["count"] += 1
-                role_summary[r.id]["amount"] += w
+                rs = role_summary[r.id]
+                rs[0] += 1
+                rs[1] += w
+                if rs[2] is None: rs[2] = r.mention
 
             if dm_prefs.get(member.id, True):
-                payout_data_list.append((member, member_total, matching))
+                key = frozenset(r.id for _, r in matching)
+                parts = slip_parts.get(key)
+                if parts is None:
+                    sorted_matching = sorted(matching, key=lambda x: x[0], reverse=True)
+                    parts = slip_parts[key] = (
+                        sorted_matching[0][1].name,
+                        " + ".join([f"{w:,}" for w, r in sorted_matching]),
+                        "\n".join([f"{i+1}. {r.name}: {w:,} Stell" for i, (w, r) in enumerate(sorted_matching)]),
+                        len(matching),
+                    )
+                payout_data_list.append((member, member_total, parts))
 
         # ── 3. DB一括書き込み (高速化の肝) ──
-        if account_updates:
+        if payroll:
             async with self.bot.get_db() as db:
                 try:
-                    # executemanyを使って1回の通信で全員分書き込む
-                    await db.executemany("""
-                        INSERT INTO accounts (user_id, balance, total_earned) VALUES (?, ?, ?)
+                    # 最初に書き込みロックを取り、全員分を1トランザクション（WALへの書き出し1回）で書く
+                    await db.execute("BEGIN IMMEDIATE")
+
+                    # 支給額を一時テーブルへ1回だけ流し込み、口座と取引ログは
+                    # そこから INSERT ... SELECT でまとめて（行ごとではなく集合で）書く
+                    await db.execute("CREATE TEMP TABLE IF NOT EXISTS tmp_payroll (user_id INTEGER PRIMARY KEY, amount INTEGER NOT NULL)")
+                    await db.executemany("INSERT INTO tmp_payroll (user_id, amount) VALUES (?, ?)", payroll)
+
+                    await db.execute("""
+                        INSERT INTO accounts (user_id, balance, total_earned)
+                        SELECT user_id, amount, amount FROM tmp_payroll WHERE true
                         ON CONFLICT(user_id) DO UPDATE SET 
                         balance = balance + excluded.balance, total_earned = total_earned + excluded.total_earned
-                    """, account_updates)
+                    """)
 
-                    await db.executemany("""
+                    await db.execute("""
                         INSERT INTO transactions (sender_id, receiver_id, amount, type, batch_id, month_tag, description)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, transaction_inserts)
+                        SELECT 0, user_id, amount, 'SALARY', ?, ?, ? FROM tmp_payroll
+                    """, (batch_id, month_tag, f"{month_tag} 給与"))
 
+                    await db.execute("DELETE FROM tmp_payroll")
                     await db.commit()
                 except Exception as e:
                     await db.rollback()
@@ -1477,46 +1825,55 @@ class Salary(commands.Cog):
         else:
              return await interaction.followup.send("⚠️ 給与対象者がいませんでした。")
 
-        # ── 4. DM送信 (レート制限対策付き) ──
-        sent_dm = 0
-        for m, total, matching in payout_data_list:
-            try:
-                embed = self.create_salary_slip_embed(m, total, matching, month_tag)
-                await m.send(embed=embed)
-                sent_dm += 1
-                # Discord APIのレート制限（BAN）回避のため、5件ごとに1秒休む
-                if sent_dm % 5 == 0: 
-                    await asyncio.sleep(1) 
-            except:
-                pass
+        # ── 4. DM送信 (同時送信数を絞って並列に) ──
+        # 1件ずつ待つと人数分の通信待ちが積み重なるので、最大5件ずつ重ねて送る
+        # 送信ペースはトークンバケットで毎秒5件に均し（以前の「5件送って1秒待つ」と同じ速さ）、
+        # 実際に 429 が返った時だけ指定秒数待って1回やり直す
+        # 遅くしすぎると大人数の時に応答トークン（15分）が切れて完了報告が送れなくなる
+        sem = asyncio.Semaphore(5)
+        bucket = TokenBucket(rate=5, per=1.0)
+
+        async def send_one(m, total, parts) -> int:
+            embed = self.create_salary_slip_embed(total, *parts, month_tag, now)
+            async with sem:
+                for attempt in range(2):
+                    await bucket.acquire()
+                    try:
+                        await m.send(embed=embed)
+                        return 1
+                    except discord.HTTPException as e:
+                        if e.status != 429 or attempt:
+                            return 0
+                        await asyncio.sleep(getattr(e, 'retry_after', 1.0))
+                    except:
+                        return 0
+                return 0
+
+        sent_dm = sum(await asyncio.gather(*(send_one(*t) for t in payout_data_list)))
 
         await interaction.followup.send(f"💰 **一括支給完了** (ID: `{batch_id}`)\n人数: {count}名 / 総額: {total_payout:,} Stell\n通知送信: {sent_dm}名")
         await self.send_salary_log(interaction, batch_id, total_payout, count, role_summary, now)
 
-    def create_salary_slip_embed(self, member, total, matching, month_tag):
-        sorted_matching = sorted(matching, key=lambda x: x[0], reverse=True)
-        main_role = sorted_matching[0][1]
-        
+    def create_salary_slip_embed(self, total, main_role_name, formula, breakdown, role_count, month_tag, now):
+        """明細の文字列（計算式・内訳など）は distribute_all 側で組み立て済みのものを受け取る"""
         embed = discord.Embed(
             title="💰 月給支給のお知らせ",
             description=f"**{month_tag}** の月給が支給されました！",
             color=Color.SUCCESS,
-            timestamp=datetime.datetime.now()
+            timestamp=now
         )
         
         embed.add_field(name="💵 支給総額", value=f"**{total:,} Stell**", inline=False)
         
-        formula = " + ".join([f"{w:,}" for w, r in sorted_matching])
         embed.add_field(name="🧮 計算式", value=f"{formula} = **{total:,} Stell**", inline=False)
         
-        breakdown = "\n".join([f"{i+1}. {r.name}: {w:,} Stell" for i, (w, r) in enumerate(sorted_matching)])
         embed.add_field(name="📊 給与内訳", value=breakdown, inline=False)
         
-        embed.add_field(name="🏆 メインロール", value=main_role.name, inline=True)
-        embed.add_field(name="🔢 適用ロール数", value=f"{len(matching)}個", inline=True)
+        embed.add_field(name="🏆 メインロール", value=main_role_name, inline=True)
+        embed.add_field(name="🔢 適用ロール数", value=f"{role_count}個", inline=True)
         embed.add_field(name="📅 支給月", value=month_tag, inline=True)
 
-        if len(matching) > 1:
+        if role_count > 1:
             embed.add_field(
                 name="⚠️ 複数ロール適用", 
                 value="あなたは複数の給与対象ロールを持っているため、全ての給与が合算されて支給されています。", 
@@ -1551,35 +1908,33 @@ class Salary(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         
         async with self.bot.get_db() as db:
-            async with db.execute("SELECT receiver_id, amount FROM transactions WHERE batch_id = ? AND type = 'SALARY'", (batch_id,)) as cursor:
-                rows = await cursor.fetchall()
+            # 受取人ごとに合計してから回収する（同じ人への複数行を1回の更新にまとめる）
+            rows = await db.execute_fetchall("""
+                SELECT receiver_id, SUM(amount) AS amount FROM transactions
+                 WHERE batch_id = ? AND type = 'SALARY'
+                 GROUP BY receiver_id
+            """, (batch_id,))
             
             if not rows:
                 return await interaction.followup.send(f"❌ ID `{batch_id}` の給与データが見つかりません。", ephemeral=True)
             
             try:
-                for row in rows:
-                    await db.execute("""
-                        UPDATE accounts SET balance = balance - ?, total_earned = total_earned - ? 
-                        WHERE user_id = ?
-                    """, (row['amount'], row['amount'], row['receiver_id']))
+                await db.executemany("""
+                    UPDATE accounts SET balance = balance - ?, total_earned = total_earned - ? 
+                    WHERE user_id = ?
+                """, [(r['amount'], r['amount'], r['receiver_id']) for r in rows])
                 
                 await db.execute("DELETE FROM transactions WHERE batch_id = ?", (batch_id,))
                 await db.commit()
             except Exception as e:
                 await db.rollback()
-                logger.error(f"Rollback Error: {e}")
+                logger.error("Rollback Error: %s", e)
                 return await interaction.followup.send("❌ エラーが発生しました。")
 
         await interaction.followup.send(f"↩️ **ロールバック完了**\nID: `{batch_id}` の支給を回収しました。")
 
     async def send_salary_log(self, interaction, batch_id, total, count, breakdown, timestamp):
-        log_ch_id = None
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT value FROM server_config WHERE key = 'salary_log_id'") as c:
-                row = await c.fetchone()
-                if row: log_ch_id = int(row['value'])
-        
+        log_ch_id = self.bot.config.log_channel_ids.get('salary_log_id')
         if not log_ch_id: return
         channel = self.bot.get_channel(log_ch_id)
         if not channel: return
@@ -1588,7 +1943,7 @@ class Salary(commands.Cog):
         embed.add_field(name="実行者", value=interaction.user.mention, inline=True)
         embed.add_field(name="総額 / 人数", value=f"**{total:,} Stell** / {count}名", inline=True)
         
-        breakdown_text = "\n".join([f"✅ {d['mention']}: {d['amount']:,} Stell ({d['count']}名)" for d in breakdown.values()])
+        breakdown_text = "\n".join([f"✅ {mention}: {amount:,} Stell ({cnt}名)" for cnt, amount, mention in breakdown.values()])
         if breakdown_text:
             embed.add_field(name="ロール別内訳", value=breakdown_text, inline=False)
         
@@ -1606,27 +1961,8 @@ class Jackpot(commands.Cog):
         self.max_number = 999
         self.seed_money = 300000    # 初期資金（100万から30万に減額してインフレ抑制）
 
-    async def init_db(self):
-        async with self.bot.get_db() as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS lottery_tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    number INTEGER
-                )
-            """)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS server_config (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            """)
-            await db.commit()
-
     @app_commands.command(name="金庫状況", description="ステラの秘密の金庫の状況と、所持している解除コードを確認します")
     async def status(self, interaction: discord.Interaction):
-        await self.init_db()
-        
         async with self.bot.get_db() as db:
             async with db.execute("SELECT value FROM server_config WHERE key = 'jackpot_pool'") as c:
                 row = await c.fetchone()
@@ -1672,34 +2008,37 @@ class Jackpot(commands.Cog):
         total_burn = self.stella_pocket * amount
 
         async with self.bot.get_db() as db:
-            async with db.execute("SELECT COUNT(*) as count FROM lottery_tickets WHERE user_id = ?", (user.id,)) as c:
-                current_count = (await c.fetchone())['count']
-                if current_count + amount > self.limit_per_round:
-                    return await interaction.followup.send(f"ステラ「ちょっと、ガッツきすぎよ！ 上限は {self.limit_per_round}回 までだからね！」\n(残り: {self.limit_per_round - current_count}回)", ephemeral=True)
+            # 枚数確認から書き込みまでを1つのトランザクションに（連打で上限を超えないように）
+            await db.execute("BEGIN IMMEDIATE")
 
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (user.id,)) as c:
-                row = await c.fetchone()
-                if not row or row['balance'] < total_cost:
-                    return await interaction.followup.send("ステラ「…お金ないじゃん。貧乏人は帰って。」", ephemeral=True)
+            row = await fetchone(db, "SELECT COUNT(*) as count FROM lottery_tickets WHERE user_id = ?", (user.id,))
+            current_count = row['count']
+            if current_count + amount > self.limit_per_round:
+                await db.rollback()
+                return await interaction.followup.send(f"ステラ「ちょっと、ガッツきすぎよ！ 上限は {self.limit_per_round}回 までだからね！」\n(残り: {self.limit_per_round - current_count}回)", ephemeral=True)
+
+            # 残高確認と引き落としを1文で（足りなければ行が返らない）
+            if await fetchone(db, SQL_TRY_DEBIT_RETURNING, (total_cost, user.id, total_cost)) is None:
+                await db.rollback()
+                return await interaction.followup.send("ステラ「…お金ないじゃん。貧乏人は帰って。」", ephemeral=True)
 
             try:
-                # ユーザーからお金を引き落とし
-                await db.execute("UPDATE accounts SET balance = balance - ? WHERE user_id = ?", (total_cost, user.id))
-                
                 # プール追加分のみ金庫へ。残りの burn 分はどこにも足さず「消滅（インフレ対策）」させる
                 await db.execute("""
                     INSERT INTO server_config (key, value) VALUES ('jackpot_pool', ?) 
                     ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + ?
                 """, (total_pool_add, total_pool_add))
 
-                new_codes = []
-                my_numbers = []
-                for _ in range(amount):
-                    num = random.randint(0, self.max_number)
-                    new_codes.append((user.id, num))
-                    my_numbers.append(f"{num:03d}")
+                # コードは1回の呼び出しでまとめて抽選する
+                nums = random.choices(range(self.max_number + 1), k=amount)
+                new_codes = [(user.id, n) for n in nums]
+                my_numbers = [f"{n:03d}" for n in nums]
                 
-                await db.executemany("INSERT INTO lottery_tickets (user_id, number) VALUES (?, ?)", new_codes)
+                # 1人あたり最大 limit_per_round 枚なので、複数行 VALUES の1文で入れ切れる
+                await db.execute(
+                    "INSERT INTO lottery_tickets (user_id, number) VALUES " + ",".join(["(?, ?)"] * len(new_codes)),
+                    [v for row in new_codes for v in row]
+                )
                 await db.commit()
 
                 num_display = ", ".join(my_numbers)
@@ -1722,21 +2061,25 @@ class Jackpot(commands.Cog):
     async def draw(self, interaction: discord.Interaction, panic_release: bool = False):
         await interaction.response.defer()
         
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT value FROM server_config WHERE key = 'jackpot_pool'") as c:
-                row = await c.fetchone()
-                current_pool = int(row['value']) if row else self.seed_money
-                if current_pool < self.seed_money: current_pool = self.seed_money
-
         winning_number = random.randint(0, self.max_number)
         winners = []
         is_panic = False
 
         async with self.bot.get_db() as db:
+            # プールの読み取りから払い出し・リセット・コード削除までを1トランザクションで行う
+            # （途中で buy が割り込んでプールやコードが食い違わないように）
+            await db.execute("BEGIN IMMEDIATE")
+
+            row = await fetchone(db, "SELECT value FROM server_config WHERE key = 'jackpot_pool'")
+            current_pool = int(row['value']) if row else self.seed_money
+            if current_pool < self.seed_money: current_pool = self.seed_money
+
             if panic_release:
                 async with db.execute("SELECT user_id, number FROM lottery_tickets") as c:
                     all_sold = await c.fetchall()
-                if not all_sold: return await interaction.followup.send("⚠️ コードが一つも生成されていません。")
+                if not all_sold:
+                    await db.rollback()
+                    return await interaction.followup.send("⚠️ コードが一つも生成されていません。")
                 
                 is_panic = True
                 lucky = random.choice(all_sold)
@@ -1757,11 +2100,8 @@ class Jackpot(commands.Cog):
                 actual_prize_pool = current_pool - stella_tax
                 
                 prize_per_winner = actual_prize_pool // len(winners)
-                winner_mentions = []
-                for w in winners:
-                    uid = w['user_id']
-                    await db.execute("UPDATE accounts SET balance = balance + ? WHERE user_id = ?", (prize_per_winner, uid))
-                    winner_mentions.append(f"<@{uid}>")
+                # 当選者全員への支払いは1回の executemany で（当選コード1枚につき1口）
+                await db.executemany(SQL_CREDIT, [(prize_per_winner, w['user_id']) for w in winners])
                 
                 # プールを初期資金(30万)にリセット
                 await db.execute("UPDATE server_config SET value = ? WHERE key = 'jackpot_pool'", (str(self.seed_money),))
@@ -1775,8 +2115,16 @@ class Jackpot(commands.Cog):
                 embed.description = f"{desc}\n\n🎉 **{len(winners)}名** のハッカーが金庫破りに成功しました！"
                 embed.add_field(name="💰 1人あたりの獲得額", value=f"**{prize_per_winner:,} Stell** (手数料引抜き後)", inline=False)
                 
-                mentions = " ".join(list(set(winner_mentions)))
-                if len(mentions) > 1000: mentions = f"{len(winners)}名の当選者"
+                # 重複を除いて順に詰め、1000文字を超えた時点で打ち切って人数表示にする
+                parts, length = [], 0
+                for uid in dict.fromkeys(w['user_id'] for w in winners):
+                    m = f"<@{uid}>"
+                    length += len(m) + (1 if parts else 0)
+                    if length > 1000:
+                        parts = None
+                        break
+                    parts.append(m)
+                mentions = " ".join(parts) if parts is not None else f"{len(winners)}名の当選者"
                 embed.add_field(name="🏆 成功者一覧", value=mentions, inline=False)
                 
                 embed.set_footer(text=f"金庫の残高はシステムによって{self.seed_money:,} Stellにリセットされました。")
@@ -1811,17 +2159,18 @@ class Jackpot(commands.Cog):
 
 # ========== ヘルパー関数 ==========
 DICE_EMOJI = {1:"⚀", 2:"⚁", 3:"⚂", 4:"⚃", 5:"⚄", 6:"⚅"}
+_DIE_FACES = (1, 2, 3, 4, 5, 6)
 
 def dice_str(dice):
     return " ".join(DICE_EMOJI[d] for d in dice)
 
-def judge_roll(dice):
+def _judge_raw(dice):
     """
     Returns (role_name, score, mult)
     mult: 5=ピンゾロ / 3=ゾロ目 / 2=シゴロ / None=目あり / -1=ヒフミ / 0=ハチ目
     """
     d = sorted(dice)
-    counts = {v: dice.count(v) for v in set(dice)}
+    counts = Counter(dice)
     if d == [1,1,1]:         return ("🌟 ピンゾロ！",      100,  5)
     if len(counts) == 1:     return (f"✨ ゾロ目({d[0]})", d[0]*10+50, 3)
     if d == [4,5,6]:         return ("🔥 シゴロ！",         99,   2)
@@ -1832,12 +2181,22 @@ def judge_roll(dice):
                 return (f"🎯 目あり({v})", v, None)
     return ("😶 ハチ目", 0, 0)
 
+# 出目3つの全組み合わせ（6^3=216通り）の役を起動時に判定しておく
+_ROLL_TABLE = {
+    (a, b, c): _judge_raw([a, b, c])
+    for a in range(1, 7) for b in range(1, 7) for c in range(1, 7)
+}
+
+def judge_roll(dice):
+    """Returns (role_name, score, mult)。役の中身は _judge_raw を参照"""
+    return _ROLL_TABLE[tuple(dice)]
+
 def roll_until_role(max_tries=3):
     """役が出るまで最大3回。Returns (all_rolls, role_name, score, mult)"""
     all_rolls = []
     role_name, score, mult = "😶 ハチ目", 0, 0
     for _ in range(max_tries):
-        dice = [random.randint(1,6) for _ in range(3)]
+        dice = random.choices(_DIE_FACES, k=3)
         all_rolls.append(dice)
         role_name, score, mult = judge_roll(dice)
         if mult != 0:
@@ -2052,6 +2411,7 @@ class ChinchiroSession:
     def __init__(self, host, bet, channel_id):
         self.host       = host
         self.bet        = bet
+        self.venue_fee  = int(bet * Chinchiro.VENUE_RATE)  # 場所代は卓を立てた時に1回だけ計算
         self.channel_id = channel_id
         self.players    = []
         self.phase      = "recruiting"
@@ -2081,7 +2441,7 @@ class ChinchiroRecruitView(discord.ui.View):
         if len(s.players) >= 7:
             return await interaction.response.send_message("満員じゃん", ephemeral=True)
 
-        venue_fee = int(s.bet * Chinchiro.VENUE_RATE)
+        venue_fee = s.venue_fee
         async with self.cog.bot.get_db() as db:
             bal = await self.cog._get_stell(db, user.id)
         if bal < s.bet + venue_fee:
@@ -2120,14 +2480,13 @@ class ChinchiroRecruitView(discord.ui.View):
 
     async def on_timeout(self):
         ch_id = self.session.channel_id
-        if ch_id in self.cog.sessions:
-            del self.cog.sessions[ch_id]
+        self.cog.sessions.pop(ch_id, None)
         for child in self.children:
             child.disabled = True
 
     async def _update_panel(self, interaction: discord.Interaction):
         s         = self.session
-        venue_fee = int(s.bet * Chinchiro.VENUE_RATE)
+        venue_fee = s.venue_fee
         embed     = discord.Embed(title="🎲 チンチロ 参加者募集中！", color=Color.GAMBLE)
         embed.description = (
             f"**親:** {s.host.mention}\n"
@@ -2166,6 +2525,8 @@ class Chinchiro(commands.Cog):
         self.bot       = bot
         self.sessions  : dict = {}
         self.cooldowns : dict = {}
+        # 卓の存在確認から登録までを直列化する（間に await があるので同時に2卓立たないように）
+        self._session_lock = asyncio.Lock()
 
     def _check_cd(self, user_id) -> int | None:
         if user_id in self.cooldowns:
@@ -2177,28 +2538,14 @@ class Chinchiro(commands.Cog):
         return None
 
     async def _get_stell(self, db, user_id: int) -> int:
-        async with db.execute(
-            "SELECT balance FROM accounts WHERE user_id = ?", (user_id,)
-        ) as c:
-            row = await c.fetchone()
+        row = await fetchone(
+            db,
+            SQL_GET_BALANCE, (user_id,)
+        )
         return row["balance"] if row else 0
 
     async def _add_stell(self, db, user_id: int, amount: int):
-        await db.execute("""
-            INSERT INTO accounts (user_id, balance, total_earned)
-            VALUES (?, ?, 0)
-            ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance
-        """, (user_id, amount))
-
-    async def _sub_stell(self, db, user_id: int, amount: int) -> bool:
-        bal = await self._get_stell(db, user_id)
-        if bal < amount:
-            return False
-        await db.execute(
-            "UPDATE accounts SET balance = balance - ? WHERE user_id = ?",
-            (amount, user_id)
-        )
-        return True
+        await db.execute(SQL_CREDIT_UPSERT, (user_id, amount))
 
     # ── /チンチロ ─────────────────────────────────────────
     @app_commands.command(name="チンチロ", description="チンチロの親になってゲームを開始します（Stell）")
@@ -2208,13 +2555,6 @@ class Chinchiro(commands.Cog):
         ch_id = interaction.channel_id
         user  = interaction.user
 
-        if ch_id in self.sessions:
-            s = self.sessions[ch_id]
-            return await interaction.response.send_message(
-                f"❌ **{s.host.display_name}** がゲームを開いています。",
-                ephemeral=True
-            )
-
         rem = self._check_cd(user.id)
         if rem:
             return await interaction.response.send_message(
@@ -2222,16 +2562,25 @@ class Chinchiro(commands.Cog):
             )
 
         venue_fee = int(bet * self.VENUE_RATE)
-        async with self.bot.get_db() as db:
-            bal = await self._get_stell(db, user.id)
+        async with self._session_lock:
+            s = self.sessions.get(ch_id)
+            if s is None:
+                async with self.bot.get_db(readonly=True) as db:
+                    bal = await self._get_stell(db, user.id)
+                if bal >= bet + venue_fee:
+                    session = ChinchiroSession(host=user, bet=bet, channel_id=ch_id)
+                    self.sessions[ch_id] = session
+
+        if s is not None:
+            return await interaction.response.send_message(
+                f"❌ **{s.host.display_name}** がゲームを開いています。",
+                ephemeral=True
+            )
         if bal < bet + venue_fee:
             return await interaction.response.send_message(
                 f"セスタ「{c_line('broke')}」", ephemeral=True
             )
 
-        session = ChinchiroSession(host=user, bet=bet, channel_id=ch_id)
-        self.sessions[ch_id] = session
-
         embed = discord.Embed(title="🎲 チンチロ 参加者募集中！", color=Color.GAMBLE)
         embed.description = (
             f"セスタ「{c_line('start')}」\n\n"
@@ -2247,31 +2596,33 @@ class Chinchiro(commands.Cog):
     # ── PVP 戦闘コア ──────────────────────────────────────
     async def _execute_pvp(self, interaction: discord.Interaction, s: ChinchiroSession):
         bet         = s.bet
-        venue_fee   = int(bet * self.VENUE_RATE)
+        venue_fee   = s.venue_fee
         all_members = [s.host] + s.players
 
-        # 残高チェック（Stell）
-        broke = []
+        # 残高チェックと全員からのStell引き落としを1トランザクションで
+        cost = bet + venue_fee
         async with self.bot.get_db() as db:
-            for m in all_members:
-                bal = await self._get_stell(db, m.id)
-                if bal < bet + venue_fee:
-                    broke.append(m)
+            await db.execute("BEGIN IMMEDIATE")
+            rows = await db.execute_fetchall(
+                f"SELECT user_id, balance FROM accounts WHERE user_id IN ({','.join('?' * len(all_members))})",
+                [m.id for m in all_members]
+            )
+            balances = {r["user_id"]: r["balance"] for r in rows}
+            broke = [m for m in all_members if balances.get(m.id, 0) < cost]
+            if broke:
+                await db.rollback()
+            else:
+                await db.executemany(SQL_DEBIT, [(cost, m.id) for m in all_members])
+                await db.commit()
         if broke:
             s.phase = "recruiting"
             return await interaction.channel.send(
                 f"❌ 残高不足: {', '.join(m.display_name for m in broke)}\n"
                 f"セスタ「{c_line('broke')}」"
-            )
-
-        # 全員からStell引き落とし
-        async with self.bot.get_db() as db:
-            for m in all_members:
-                await self._sub_stell(db, m.id, bet + venue_fee)
-            await db.commit()
+            )
 
         total_burn = venue_fee * len(all_members)
-        month_tag  = datetime.datetime.now().strftime("%Y-%m")
+        month_tag  = _month_tag()
         num_children = len(s.players)
 
         # ── 親のサイコロ演出 ──────────────────────────────
@@ -2288,7 +2639,7 @@ class Chinchiro(commands.Cog):
             await asyncio.sleep(0.8)
             embed.description = (
                 f"**親:** {s.host.mention}\n\n"
-                f"🎲 {dice_str([random.randint(1,6) for _ in range(3)])} ← 飛んだ！\n\n"
+                f"🎲 {dice_str(random.choices(_DIE_FACES, k=3))} ← 飛んだ！\n\n"
                 f"💦 **ションベン！** 親の即負け！\n"
                 f"セスタ「{c_line('shonben_fly')}」"
             )
@@ -2297,19 +2648,17 @@ class Chinchiro(commands.Cog):
 
             # 子全員に bet×2 返却（Stell）
             async with self.bot.get_db() as db:
-                for m in s.players:
-                    await self._add_stell(db, m.id, bet * 2)
+                await db.executemany(SQL_CREDIT_UPSERT, [(m.id, bet * 2) for m in s.players])
                 await db.commit()
 
             now = datetime.datetime.now()
             for m in all_members:
                 self.cooldowns[m.id] = now
-            if s.channel_id in self.sessions:
-                del self.sessions[s.channel_id]
+            self.sessions.pop(s.channel_id, None)
             return
 
         # 通常の親のロール
-        h_rolls, h_role, h_score, h_mult = await self._animated_roll(
+        h_rolls, h_role, h_score, h_mult, h_parts = await self._animated_roll(
             msg, embed, s.host, is_host=True
         )
 
@@ -2317,16 +2666,16 @@ class Chinchiro(commands.Cog):
         results        = {}
         child_shonbens = {}
 
+        rand = random.random
         for m in s.players:
-            shonben = random.random() < self.SHONBEN_RATE
+            shonben = rand() < self.SHONBEN_RATE
             child_shonbens[m.id] = shonben
             if shonben:
-                results[m.id] = ([], "💦 ションベン", -999, -2)
+                results[m.id] = ([], "💦 ションベン", -999, -2, [])
             else:
-                rolls, rname, score, mult = await self._animated_roll(
+                results[m.id] = await self._animated_roll(
                     msg, embed, m, is_host=False, host_role=h_role
                 )
-                results[m.id] = (rolls, rname, score, mult)
 
         # ── 精算（ゼロサム・Stell）────────────────────────
         # C案: 子が勝ったとき払い出し額 = min(bet*役倍率, 親のbet)
@@ -2339,60 +2688,60 @@ class Chinchiro(commands.Cog):
         # 親が勝った子から受け取れる額のプール
         host_pool = bet * num_children  # 子全員のbet合計
 
-        async with self.bot.get_db() as db:
-            for m in s.players:
-                rolls, role_name, score, mult = results[m.id]
-
-                if child_shonbens[m.id]:
-                    child_lines.append(
-                        f"💦 {m.mention} **ションベン！** 即負け\n"
-                        f"セスタ「{c_line('shonben_fly')}」"
-                    )
-                    lose_members.append(m)
-                    continue
+        deltas: list[tuple[int, int]] = []  # (user_id, 払い戻し額)
+        for m in s.players:
+            rolls, role_name, score, mult, parts = results[m.id]
 
-                outcome = determine_outcome(h_mult, h_score, mult, score)
-                parts   = []
-                for i, r in enumerate(rolls):
-                    suffix = f"**{role_name}**" if i == len(rolls)-1 else "ハチ目"
-                    parts.append(f"　{i+1}投目: {dice_str(r)} {suffix}")
-                roll_disp = "\n".join(parts)
-
-                if outcome == "child_win":
-                    # 払い出し = bet + min(bet×役倍率, 親のpool残り)
-                    raw_win   = bet * pvp_payout_mult(mult)
-                    actual_win = min(raw_win, host_pool)
-                    host_pool -= actual_win
-                    payout    = bet + actual_win
-                    await self._add_stell(db, m.id, payout)
-                    child_lines.append(
-                        f"✅ {m.mention}\n{roll_disp}\n"
-                        f"　→ **子の勝ち！** +{actual_win:,} Stell"
-                    )
-                    win_members.append((m, mult, actual_win))
+            if child_shonbens[m.id]:
+                child_lines.append(
+                    f"💦 {m.mention} **ションベン！** 即負け\n"
+                    f"セスタ「{c_line('shonben_fly')}」"
+                )
+                lose_members.append(m)
+                continue
 
-                elif outcome == "host_win":
-                    child_lines.append(
-                        f"❌ {m.mention}\n{roll_disp}\n　→ **親の勝ち**"
-                    )
-                    lose_members.append(m)
+            outcome   = determine_outcome(h_mult, h_score, mult, score)
+            roll_disp = "\n".join(parts)
 
-                else:
-                    await self._add_stell(db, m.id, bet)
-                    child_lines.append(
-                        f"🟡 {m.mention}\n{roll_disp}\n　→ **引き分け**（返却）"
-                    )
-                    draw_members.append(m)
+            if outcome == "child_win":
+                # 払い出し = bet + min(bet×役倍率, 親のpool残り)
+                raw_win   = bet * pvp_payout_mult(mult)
+                actual_win = min(raw_win, host_pool)
+                host_pool -= actual_win
+                payout    = bet + actual_win
+                deltas.append((m.id, payout))
+                child_lines.append(
+                    f"✅ {m.mention}\n{roll_disp}\n"
+                    f"　→ **子の勝ち！** +{actual_win:,} Stell"
+                )
+                win_members.append((m, mult, actual_win))
 
-            # 親の精算
-            # 親の受け取り = 元本 + 負けた子のbet - 勝った子に払った額
-            total_won  = sum(w for _, _, w in win_members)
-            total_lost = len(lose_members) * bet
-            host_return = bet + total_lost - total_won
-            if host_return > 0:
-                await self._add_stell(db, s.host.id, host_return)
+            elif outcome == "host_win":
+                child_lines.append(
+                    f"❌ {m.mention}\n{roll_disp}\n　→ **親の勝ち**"
+                )
+                lose_members.append(m)
 
-            await db.commit()
+            else:
+                deltas.append((m.id, bet))
+                child_lines.append(
+                    f"🟡 {m.mention}\n{roll_disp}\n　→ **引き分け**（返却）"
+                )
+                draw_members.append(m)
+
+        # 親の精算
+        # 親の受け取り = 元本 + 負けた子のbet - 勝った子に払った額
+        total_won  = sum(w for _, _, w in win_members)
+        total_lost = len(lose_members) * bet
+        host_return = bet + total_lost - total_won
+        if host_return > 0:
+            deltas.append((s.host.id, host_return))
+
+        # 払い戻しは最後に1回の executemany でまとめて反映する
+        if deltas:
+            async with self.bot.get_db() as db:
+                await db.executemany(SQL_CREDIT_UPSERT, deltas)
+                await db.commit()
 
         # ── 結果Embed ─────────────────────────────────────
         if not win_members and not draw_members:
@@ -2402,10 +2751,6 @@ class Chinchiro(commands.Cog):
         else:
             key = "host_win_partial"
 
-        h_parts = []
-        for i, r in enumerate(h_rolls):
-            suffix = f"**{h_role}**" if i == len(h_rolls)-1 else "ハチ目"
-            h_parts.append(f"　{i+1}投目: {dice_str(r)} {suffix}")
 
         result_embed = discord.Embed(
             title="🎲 チンチロ 結果発表！",
@@ -2438,8 +2783,7 @@ class Chinchiro(commands.Cog):
         now = datetime.datetime.now()
         for m in all_members:
             self.cooldowns[m.id] = now
-        if s.channel_id in self.sessions:
-            del self.sessions[s.channel_id]
+        self.sessions.pop(s.channel_id, None)
 
     # ── サイコロアニメーション ────────────────────────────
     async def _animated_roll(
@@ -2456,15 +2800,13 @@ class Chinchiro(commands.Cog):
 
             # セリフ選択
             if i == 0:
-                _, _, m0 = judge_roll(dice)
-                if m0 == 0:    selife = c_line("roll1_hachi")
-                elif m0 == -1: selife = c_line("roll1_hifumi")
+                if tmp_mult == 0:    selife = c_line("roll1_hachi")
+                elif tmp_mult == -1: selife = c_line("roll1_hifumi")
                 else:          selife = c_line("roll1_good")
             elif i == 1:
-                _, _, m1 = judge_roll(dice)
                 # 前の目と合わせてリーチ判定
                 prev = rolls[0]
-                if m1 == 0:
+                if tmp_mult == 0:
                     selife = c_line("roll2_hachi")
                 elif any(dice.count(v) >= 2 for v in dice):
                     selife = c_line("roll2_reach")
@@ -2489,7 +2831,8 @@ class Chinchiro(commands.Cog):
             await msg.edit(embed=embed)
             await asyncio.sleep(1.0)
 
-        return rolls, role_name, score, mult
+        # 各投の表示行も返して、結果Embedで組み立て直さずに使い回す
+        return rolls, role_name, score, mult, all_parts
 
     # ── /チンチロ解散 ──────────────────────────────────────
     @app_commands.command(name="チンチロ解散", description="開催中のゲームを解散します")
@@ -2497,16 +2840,16 @@ class Chinchiro(commands.Cog):
         ch_id = interaction.channel_id
         user  = interaction.user
 
-        if ch_id not in self.sessions:
+        s = self.sessions.get(ch_id)
+        if s is None:
             return await interaction.response.send_message(
                 "❌ 開催中のゲームはありません。", ephemeral=True
             )
-        s = self.sessions[ch_id]
         if s.host.id != user.id and not user.guild_permissions.administrator:
             return await interaction.response.send_message(
                 "セスタ「解散できるのは親だけじゃん」", ephemeral=True
             )
-        del self.sessions[ch_id]
+        self.sessions.pop(ch_id, None)
         await interaction.response.send_message(
             f"🚫 ゲームを解散しました。\nセスタ「また来てよ。……待ってるから」"
         )
@@ -2553,44 +2896,34 @@ class Chinchiro(commands.Cog):
             )
 
 # ── 日次プレイ上限チェック ──
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        today = _day_tag(datetime.datetime.now())
         daily_limit = await _cfg(self.bot, "chinchiro_daily_limit")
+        venue_fee = int(bet * 0.02)   # ソロは場所代2%
+        cost      = bet + venue_fee
+
+        # 上限・残高の確認から場所代引き落とし＆プレイカウント記録までを1トランザクションで
         async with self.bot.get_db() as db:
-            async with db.execute(
-                "SELECT 1 FROM daily_play_exemptions WHERE user_id=? AND game='chinchiro' AND date=?",
-                (user.id, today)
-            ) as c:
-                exempt = await c.fetchone()
-            async with db.execute(
-                "SELECT count FROM daily_play_counts WHERE user_id=? AND game='chinchiro' AND date=?",
-                (user.id, today)
-            ) as c:
-                row = await c.fetchone()
-            play_count = row["count"] if row else 0
-        if not exempt and play_count >= daily_limit:
+            await db.execute("BEGIN IMMEDIATE")
+            gate = await fetchone(db, SQL_PLAY_GATE, {"uid": user.id, "game": 'chinchiro', "today": today})
+            limit_hit = not gate["exempt"] and gate["count"] >= daily_limit
+            broke     = gate["balance"] < cost
+            if limit_hit or broke:
+                await db.rollback()
+            else:
+                await db.execute(SQL_CESTA_DEBIT, (cost, user.id))
+                newly = await cesta_cog.record_spend(db, user.id, cost)
+                await db.execute(SQL_BUMP_DAILY_COUNT, (user.id, 'chinchiro', today))
+                await db.commit()
+        if limit_hit:
             return await interaction.response.send_message(
                 f"🚫 今日のチンチロ上限（**{daily_limit}回**）に達したよ！また明日ね〜♪",
                 ephemeral=True
             )
-
-        venue_fee = int(bet * 0.02)   # ソロは場所代2%
-        bal       = await cesta_cog.get_balance(user.id)
-        if bal < bet + venue_fee:
+        if broke:
             return await interaction.response.send_message(
                 f"セスタ「{c_line('broke')}」", ephemeral=True
             )
 
-        # 場所代引き落とし＆プレイカウント記録
-        async with self.bot.get_db() as db:
-            await cesta_cog.sub_balance(db, user.id, bet + venue_fee)
-            newly = await cesta_cog.record_spend(db, user.id, bet + venue_fee)
-            await db.execute("""
-                INSERT INTO daily_play_counts (user_id, game, date, count)
-                VALUES (?, 'chinchiro', ?, 1)
-                ON CONFLICT(user_id, game, date) DO UPDATE SET count = count + 1
-            """, (user.id, today))
-            await db.commit()
-
         embed = discord.Embed(
             title="🎲 チンチロ ソロ戦！",
             description=(
@@ -2611,7 +2944,7 @@ class Chinchiro(commands.Cog):
             await asyncio.sleep(0.8)
             embed.description = (
                 f"**{user.display_name}** の1投目\n\n"
-                f"🎲 {dice_str([random.randint(1,6) for _ in range(3)])} ← 飛んだ！\n\n"
+                f"🎲 {dice_str(random.choices(_DIE_FACES, k=3))} ← 飛んだ！\n\n"
                 f"💦 **ションベン！** アンタの即負け！\n"
                 f"セスタ「{c_line('solo_shonben_player')}」"
             )
@@ -2621,7 +2954,7 @@ class Chinchiro(commands.Cog):
             return
 
         # ── プレイヤーのロール ──
-        p_rolls, p_role, p_score, p_mult = await self._animated_roll(
+        p_rolls, p_role, p_score, p_mult, p_parts = await self._animated_roll(
             msg, embed, user, is_host=False
         )
 
@@ -2630,7 +2963,7 @@ class Chinchiro(commands.Cog):
 
         if sesta_shonben:
             await asyncio.sleep(0.8)
-            s_parts = [f"　1投目: {dice_str([random.randint(1,6) for _ in range(3)])} ← 飛んだ！"]
+            s_parts = [f"　1投目: {dice_str(random.choices(_DIE_FACES, k=3))} ← 飛んだ！"]
             embed.description = (
                 f"👾 セスタの番\n\n"
                 + "\n".join(s_parts)
@@ -2643,10 +2976,9 @@ class Chinchiro(commands.Cog):
             # プレイヤーに報酬
             reward = int(bet * 2.0)
             async with self.bot.get_db() as db:
-                await cesta_cog.add_balance(db, user.id, reward)
+                new_bal = await cesta_cog.add_balance_returning(db, user.id, reward)
                 await db.commit()
 
-            new_bal = await cesta_cog.get_balance(user.id)
             result_embed = discord.Embed(
                 title="🎲 チンチロ ソロ戦 結果",
                 color=Color.SUCCESS
@@ -2674,9 +3006,9 @@ class Chinchiro(commands.Cog):
         s_parts    = []
 
         for i in range(3):
-            dice = [random.randint(1, 6) for _ in range(3)]
+            dice = random.choices(_DIE_FACES, k=3)
             s_rolls.append(dice)
-            s_role_tmp, s_score_tmp, s_mult_tmp = judge_roll(dice)[0], judge_roll(dice)[1], judge_roll(dice)[2]
+            s_role_tmp, s_score_tmp, s_mult_tmp = judge_roll(dice)
 
             is_last = (i == 2) or (s_mult_tmp != 0)
             suffix  = f"**{s_role_tmp}**" if is_last else "ハチ目"
@@ -2703,22 +3035,24 @@ class Chinchiro(commands.Cog):
         # ── 勝敗判定 ──
         outcome = determine_outcome(s_mult, s_score, p_mult, p_score)
 
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
+        month_tag = _month_tag()
         payout    = 0
 
         async with self.bot.get_db() as db:
             if outcome == "child_win":
                 reward_mult = solo_reward_mult(p_mult)
                 payout      = int(bet * reward_mult)
-                logger.info(f"[SOLO DEBUG] p_mult={p_mult}, reward_mult={reward_mult}, bet={bet}, payout={payout}")
-                await cesta_cog.add_balance(db, user.id, payout)
+                logger.info("[SOLO DEBUG] p_mult=%s, reward_mult=%s, bet=%s, payout=%s", p_mult, reward_mult, bet, payout)
+                new_bal = await cesta_cog.add_balance_returning(db, user.id, payout)
             elif outcome == "draw":
                 payout = bet
-                await cesta_cog.add_balance(db, user.id, payout)
-            # 負けは没収のまま
+                new_bal = await cesta_cog.add_balance_returning(db, user.id, payout)
+            else:
+                # 負けは没収のまま（表示用に今の残高だけ読む）
+                row = await fetchone(db, "SELECT balance FROM cesta_wallets WHERE user_id = ?", (user.id,))
+                new_bal = row["balance"] if row else 0
             await db.commit()
 
-        new_bal = await cesta_cog.get_balance(user.id)
         net     = payout - bet
 
         # ── 結果Embed ──
@@ -2735,10 +3069,6 @@ class Chinchiro(commands.Cog):
             result   = f"🟡 **引き分け**"
             selife   = c_line("solo_draw")
 
-        p_parts = []
-        for i, r in enumerate(p_rolls):
-            suffix = f"**{p_role}**" if i == len(p_rolls)-1 else "ハチ目"
-            p_parts.append(f"　{i+1}投目: {dice_str(r)} {suffix}")
 
         result_embed = discord.Embed(
             title="🎲 チンチロ ソロ戦 結果",
@@ -2812,6 +3142,9 @@ BLACKJACK_LINES = {
         "ブラックジャック……はぁ、すごいじゃん。認めたくないけど認める",
     ],
 }
+# 台詞は変更しないのでタプルで持つ（random.choice の対象として軽い）
+BLACKJACK_LINES = {k: tuple(v) for k, v in BLACKJACK_LINES.items()}
+_BJ_DEFAULT = ("……",)
 
 CARD_SUITS = ["♠", "♥", "♦", "♣"]
 CARD_RANKS = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
@@ -2844,8 +3177,7 @@ def bj_new_deck():
     return deck
 
 def c_line_bj(key):
-    lines = BLACKJACK_LINES.get(key, ["……"])
-    return random.choice(lines)
+    return random.choice(BLACKJACK_LINES.get(key, _BJ_DEFAULT))
 
 
 class BlackjackView(discord.ui.View):
@@ -2914,7 +3246,7 @@ class BlackjackView(discord.ui.View):
                 await db.commit()
             except Exception as e:
                 await db.rollback()
-                logger.error(f"BJ _finish DB error (user={interaction.user.id}): {e}")
+                logger.error("BJ _finish DB error (user=%s): %s", interaction.user.id, e)
                 await interaction.response.edit_message(
                     content="❌ 精算処理中にエラーが発生しました。管理者にお問い合わせください。",
                     embed=None, view=None
@@ -2972,42 +3304,32 @@ class Blackjack(commands.Cog):
         cesta_cog = self.bot.get_cog("CestaSystem")
 
 # ── 日次プレイ上限チェック ──
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        today = _day_tag(datetime.datetime.now())
         daily_limit = await _cfg(self.bot, "slot_daily_limit")
+
+        # 上限・残高の確認から引き落とし＆プレイカウント記録までを1トランザクションで
         async with self.bot.get_db() as db:
-            async with db.execute(
-                "SELECT 1 FROM daily_play_exemptions WHERE user_id=? AND game='blackjack' AND date=?",
-                (user.id, today)
-            ) as c:
-                exempt = await c.fetchone()
-            async with db.execute(
-                "SELECT count FROM daily_play_counts WHERE user_id=? AND game='blackjack' AND date=?",
-                (user.id, today)
-            ) as c:
-                row = await c.fetchone()
-            play_count = row["count"] if row else 0
-        if not exempt and play_count >= daily_limit:
+            await db.execute("BEGIN IMMEDIATE")
+            gate = await fetchone(db, SQL_PLAY_GATE, {"uid": user.id, "game": 'blackjack', "today": today})
+            limit_hit = not gate["exempt"] and gate["count"] >= daily_limit
+            broke     = gate["balance"] < bet
+            if limit_hit or broke:
+                await db.rollback()
+            else:
+                await db.execute(SQL_CESTA_DEBIT, (bet, user.id))
+                await cesta_cog.record_spend(db, user.id, bet)
+                await db.execute(SQL_BUMP_DAILY_COUNT, (user.id, 'blackjack', today))
+                await db.commit()
+        if limit_hit:
             return await interaction.response.send_message(
                 f"🚫 今日のブラックジャック上限（**{daily_limit}回**）に達したよ！また明日ね〜",
                 ephemeral=True
             )
-        
-        bal = await cesta_cog.get_balance(user.id)
-        if bal < bet:
+        if broke:
             return await interaction.response.send_message(
                 f"セスタ「残高が足りないじゃん。」", ephemeral=True
             )
 
-        async with self.bot.get_db() as db:
-            await cesta_cog.sub_balance(db, user.id, bet)
-            await cesta_cog.record_spend(db, user.id, bet)
-            await db.execute("""
-                INSERT INTO daily_play_counts (user_id, game, date, count)
-                VALUES (?, 'blackjack', ?, 1)
-                ON CONFLICT(user_id, game, date) DO UPDATE SET count = count + 1
-            """, (user.id, today))
-            await db.commit()
-
         deck        = bj_new_deck()
         player_hand = [deck.pop(), deck.pop()]
         sesta_hand  = [deck.pop(), deck.pop()]
@@ -3191,12 +3513,12 @@ class Omikuji(commands.Cog):
         user = interaction.user
 
         async with self.bot.get_db() as db:
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (user.id,)) as c:
+            async with db.execute(SQL_GET_BALANCE, (user.id,)) as c:
                 row = await c.fetchone()
                 if not row or row['balance'] < self.cost:
                     return await interaction.followup.send("ステラ「300Stellすら持ってないの？ 帰って。」", ephemeral=True)
 
-            await db.execute("UPDATE accounts SET balance = balance - ? WHERE user_id = ?", (self.cost, user.id))
+            await db.execute(SQL_DEBIT, (self.cost, user.id))
 
             rand = random.randint(1, 100)
             current = 0
@@ -3212,10 +3534,10 @@ class Omikuji(commands.Cog):
             profit = payout - self.cost
             
             if profit >= 0:
-                await db.execute("UPDATE accounts SET balance = balance + ? WHERE user_id = ?", (payout, user.id))
+                await db.execute(SQL_CREDIT, (payout, user.id))
             else:
                 if payout > 0:
-                    await db.execute("UPDATE accounts SET balance = balance + ? WHERE user_id = ?", (payout, user.id))
+                    await db.execute(SQL_CREDIT, (payout, user.id))
                 
                 loss_amount = abs(profit)
                 jp_feed = int(loss_amount * 0.20)
@@ -3279,9 +3601,9 @@ class VoiceSystem(commands.Cog):
                     row = await cursor.fetchone()
                     if row: self.reward_rate = int(row['value'])
             
-            logger.info(f"Loaded {len(self.target_vc_ids)} reward VCs. Rate: {self.reward_rate}/min")
+            logger.info("Loaded %s reward VCs. Rate: %s/min", len(self.target_vc_ids), self.reward_rate)
         except Exception as e:
-            logger.error(f"Failed to load voice config: {e}")
+            logger.error("Failed to load voice config: %s", e)
 
     # インフレ対策コマンド: 報酬レートの変更
     @app_commands.command(name="vc報酬レート設定", description="VC報酬の基本レート(1分あたり)を変更します")
@@ -3325,7 +3647,7 @@ class VoiceSystem(commands.Cog):
                         )
                         await db.commit()
                 except Exception as e:
-                    logger.error(f"Voice Tracking Error: {e}")
+                    logger.error("Voice Tracking Error: %s", e)
 
             # 退室 (または条件未達)
             elif was_active and not is_now_active:
@@ -3358,27 +3680,22 @@ class VoiceSystem(commands.Cog):
                 join_time = self.all_join_times.pop(member.id)
                 elapsed = int((now - join_time).total_seconds())
                 if elapsed > 0:
-                    month_tag = now.strftime("%Y-%m")
+                    month_tag = _month_tag()
                     try:
                         vc_xp = int(elapsed / 60) * 10  # 1分10XP
                         async with self.bot.get_db() as db:
-                            await db.execute(
-                                "INSERT OR IGNORE INTO vc_rank_stats (user_id, month, total_seconds) VALUES (?, ?, 0)",
-                                (member.id, month_tag)
-                            )
-                            await db.execute(
-                                "UPDATE vc_rank_stats SET total_seconds = total_seconds + ? WHERE user_id = ? AND month = ?",
-                                (elapsed, member.id, month_tag)
-                            )
+                            await db.execute("""
+                                INSERT INTO vc_rank_stats (user_id, month, total_seconds) VALUES (?, ?, ?)
+                                ON CONFLICT(user_id, month) DO UPDATE SET total_seconds = total_seconds + excluded.total_seconds
+                            """, (member.id, month_tag, elapsed))
                             # レベルXP加算
                             if vc_xp > 0:
-                                await db.execute(
-                                    "INSERT OR IGNORE INTO user_levels (user_id) VALUES (?)", (member.id,)
-                                )
-                                await db.execute(
-                                    "UPDATE user_levels SET xp = xp + ?, total_vc_seconds = total_vc_seconds + ? WHERE user_id = ?",
-                                    (vc_xp, elapsed, member.id)
-                                )
+                                await db.execute("""
+                                    INSERT INTO user_levels (user_id, xp, total_vc_seconds) VALUES (?, ?, ?)
+                                    ON CONFLICT(user_id) DO UPDATE SET
+                                        xp               = xp + excluded.xp,
+                                        total_vc_seconds = total_vc_seconds + excluded.total_vc_seconds
+                                """, (member.id, vc_xp, elapsed))
                                 # レベル更新
                                 async with db.execute("SELECT xp FROM user_levels WHERE user_id = ?", (member.id,)) as c:
                                     row = await c.fetchone()
@@ -3387,7 +3704,7 @@ class VoiceSystem(commands.Cog):
                                     await db.execute("UPDATE user_levels SET level = ? WHERE user_id = ?", (new_level, member.id))
                             await db.commit()
                     except Exception as e:
-                        logger.error(f"VC Rank Stats Error: {e}")
+                        logger.error("VC Rank Stats Error: %s", e)
 
     async def _process_reward(self, member_or_id, now):
         user_id = member_or_id.id if isinstance(member_or_id, discord.Member) else member_or_id
@@ -3398,49 +3715,38 @@ class VoiceSystem(commands.Cog):
                 async with db.execute("SELECT join_time FROM voice_tracking WHERE user_id =?", (user_id,)) as cursor:
                     row = await cursor.fetchone()
                 if not row: return
+                join_time = datetime.datetime.fromisoformat(row['join_time'])
+                sec = int((now - join_time).total_seconds())
 
-                try:
-                    join_time = datetime.datetime.fromisoformat(row['join_time'])
-                    sec = int((now - join_time).total_seconds())
-
-                    if sec < 60:
-                        reward = 0
-                    else:
-                        reward = int(self.reward_rate * (sec / 60))
-                        # 3人以上いるVCなら2倍ボーナス
-                        if member and member.voice and member.voice.channel:
-                            vc_members = [m for m in member.voice.channel.members if not m.bot]
-                            if len(vc_members) >= 3:
-                                reward *= 2
-
-                    if reward > 0:
-                        month_tag = now.strftime("%Y-%m")
-
-                        await db.execute("INSERT OR IGNORE INTO accounts (user_id, balance, total_earned) VALUES (0, 0, 0)")
-                        await db.execute("INSERT OR IGNORE INTO accounts (user_id, balance, total_earned) VALUES (?, 0, 0)", (user_id,))
+                if sec < 60:
+                    reward = 0
+                else:
+                    reward = int(self.reward_rate * (sec / 60))
+                    # 3人以上いるVCなら2倍ボーナス
+                    if member and member.voice and member.voice.channel:
+                        vc_members = [m for m in member.voice.channel.members if not m.bot]
+                        if len(vc_members) >= 3:
+                            reward *= 2
 
-                        await db.execute(
-                            "UPDATE accounts SET balance = balance +?, total_earned = total_earned +? WHERE user_id =?",
-                            (reward, reward, user_id)
-                        )
+                if reward > 0:
+                    month_tag = _month_tag()
 
-                        await db.execute(
-                            "INSERT OR IGNORE INTO voice_stats (user_id, month, total_seconds) VALUES (?, ?, 0)",
-                            (user_id, month_tag)
-                        )
-                        await db.execute(
-                            "UPDATE voice_stats SET total_seconds = total_seconds + ? WHERE user_id = ? AND month = ?",
-                            (sec, user_id, month_tag)
-                        )
-                    await db.execute("DELETE FROM voice_tracking WHERE user_id = ?", (user_id,))
-                    await db.commit()
+                    await db.execute("""
+                        INSERT INTO accounts (user_id, balance, total_earned) VALUES (?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET
+                            balance      = balance + excluded.balance,
+                            total_earned = total_earned + excluded.total_earned
+                    """, (user_id, reward, reward))
 
-                except Exception as db_err:
-                    await db.rollback()
-                    raise db_err
+                    await db.execute("""
+                        INSERT INTO voice_stats (user_id, month, total_seconds) VALUES (?, ?, ?)
+                        ON CONFLICT(user_id, month) DO UPDATE SET total_seconds = total_seconds + excluded.total_seconds
+                    """, (user_id, month_tag, sec))
+                await db.execute("DELETE FROM voice_tracking WHERE user_id = ?", (user_id,))
+                await db.commit()
 
         except Exception as e:
-            logger.error(f"Voice Reward Process Error [{user_id}]: {e}")
+            logger.error("Voice Reward Process Error [%s]: %s", user_id, e)
     @commands.Cog.listener()
     async def on_ready(self):
         if self.is_ready_processed: return
@@ -3494,14 +3800,10 @@ class VoiceSystem(commands.Cog):
 
                     ua, ub = (user_id, other_id) if user_id < other_id else (other_id, user_id)
 
-                    await db.execute(
-                        "INSERT OR IGNORE INTO bonds (user_a, user_b, total_seconds, rank) VALUES (?, ?, 0, '')",
-                        (ua, ub)
-                    )
-                    await db.execute(
-                        "UPDATE bonds SET total_seconds = total_seconds + ? WHERE user_a = ? AND user_b = ?",
-                        (elapsed, ua, ub)
-                    )
+                    await db.execute("""
+                        INSERT INTO bonds (user_a, user_b, total_seconds, rank) VALUES (?, ?, ?, '')
+                        ON CONFLICT(user_a, user_b) DO UPDATE SET total_seconds = total_seconds + excluded.total_seconds
+                    """, (ua, ub, elapsed))
                     async with db.execute("SELECT total_seconds, rank FROM bonds WHERE user_a = ? AND user_b = ?", (ua, ub)) as c:
                         bond = await c.fetchone()
                     if not bond:
@@ -3574,7 +3876,7 @@ class VoiceSystem(commands.Cog):
 
                 await db.commit()
         except Exception as e:
-            logger.error(f"Bond Update Error: {e}")
+            logger.error("Bond Update Error: %s", e)
 
 
 class BondSelectView(discord.ui.View):
@@ -3639,7 +3941,7 @@ class VoiceHistory(commands.Cog):
     ):
         await interaction.response.defer(ephemeral=True)
 
-        current_month = datetime.datetime.now().strftime("%Y-%m")
+        current_month = _month_tag()
         is_admin = await interaction.client.is_owner(interaction.user) or any(
             r.id in interaction.client.config.admin_roles and
             interaction.client.config.admin_roles[r.id] in ["SUPREME_GOD", "GODDESS"]
@@ -3655,7 +3957,7 @@ class VoiceHistory(commands.Cog):
             if not targets:
                 return await interaction.followup.send(f"❌ {role.mention} にメンバーがいません。", ephemeral=True)
 
-            async with self.bot.get_db() as db:
+            async with self.bot.get_db(readonly=True) as db:
                 async with db.execute(
                     "SELECT user_id, total_seconds FROM voice_stats WHERE month = ?",
                     (current_month,)
@@ -3702,7 +4004,7 @@ class VoiceHistory(commands.Cog):
         if target.id != interaction.user.id and not is_admin:
             return await interaction.followup.send("❌ 他のユーザーの記録を見る権限がありません。", ephemeral=True)
 
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute(
                 "SELECT total_seconds FROM voice_stats WHERE user_id = ? AND month = ?",
                 (target.id, current_month)
@@ -3726,23 +4028,37 @@ class VoiceHistory(commands.Cog):
         await interaction.followup.send(embed=embed, ephemeral=True)
 
 
-from typing import Optional
-
 _CFG_DEFAULTS = {
-    "cesta_rate":          10000,
-    "cesta_daily":         5,
-    "cesta_daily_buy_cap": 50,
-    "slot_daily_limit":    10,
-    "slot_bigwin_cd":      30,
+    "cesta_rate":            10000,
+    "cesta_daily":           5,
+    "cesta_daily_buy_cap":   50,
+    "slot_daily_limit":      10,
+    "chinchiro_daily_limit": 10,
+    "slot_bigwin_cd":        30,
 }
 
+# 設定値のキャッシュ（key -> (値, 取得時刻)）。書き換え時は _cfg_invalidate で破棄する
+_CFG_TTL = 60.0
+_cfg_cache: Dict[str, tuple] = {}
+
 async def _cfg(bot, key: str) -> int:
-    async with bot.get_db() as db:
-        async with db.execute(
+    now = time.monotonic()
+    hit = _cfg_cache.get(key)
+    if hit and now - hit[1] < _CFG_TTL:
+        return hit[0]
+
+    async with bot.get_db(readonly=True) as db:
+        row = await fetchone(
+            db,
             "SELECT value FROM server_config WHERE key = ?", (key,)
-        ) as c:
-            row = await c.fetchone()
-    return int(row["value"]) if row else _CFG_DEFAULTS[key]
+        )
+    value = int(row["value"]) if row else _CFG_DEFAULTS[key]
+    _cfg_cache[key] = (value, now)
+    return value
+
+def _cfg_invalidate(*keys: str):
+    for key in keys:
+        _cfg_cache.pop(key, None)
 
 
 class CestaSystem(commands.Cog):
@@ -3751,11 +4067,11 @@ class CestaSystem(commands.Cog):
         self.bot = bot
 
     async def get_balance(self, user_id: int) -> int:
-        async with self.bot.get_db() as db:
-            async with db.execute(
+        async with self.bot.get_db(readonly=True) as db:
+            row = await fetchone(
+                db,
                 "SELECT balance FROM cesta_wallets WHERE user_id = ?", (user_id,)
-            ) as c:
-                row = await c.fetchone()
+            )
         return row["balance"] if row else 0
 
     async def add_balance(self, db, user_id: int, amount: int):
@@ -3764,12 +4080,21 @@ class CestaSystem(commands.Cog):
             ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance
         """, (user_id, amount))
 
+    async def add_balance_returning(self, db, user_id: int, amount: int) -> int:
+        """add_balance と同じ加算を行い、加算後の残高を返す（読み直しの往復を省く）"""
+        row = await fetchone(db, """
+            INSERT INTO cesta_wallets (user_id, balance) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance
+            RETURNING balance
+        """, (user_id, amount))
+        return row["balance"]
+
     async def sub_balance(self, db, user_id: int, amount: int) -> bool:
         # 同一トランザクション内で残高チェック＋引き落としを行う（競合防止）
-        async with db.execute(
+        row = await fetchone(
+            db,
             "SELECT balance FROM cesta_wallets WHERE user_id = ?", (user_id,)
-        ) as c:
-            row = await c.fetchone()
+        )
         bal = row["balance"] if row else 0
         if bal < amount:
             return False
@@ -3781,17 +4106,17 @@ class CestaSystem(commands.Cog):
 
     @app_commands.command(name="セスタ残高", description="セスタコインの残高を確認します")
     async def cesta_balance(self, interaction: discord.Interaction):
-        async with self.bot.get_db() as db:
-            async with db.execute(
+        async with self.bot.get_db(readonly=True) as db:
+            row = await fetchone(
+                db,
                 "SELECT balance FROM cesta_wallets WHERE user_id = ?", (interaction.user.id,)
-            ) as c:
-                row = await c.fetchone()
+            )
             bal = row["balance"] if row else 0
 
-            async with db.execute(
-                "SELECT balance FROM accounts WHERE user_id = ?", (interaction.user.id,)
-            ) as c:
-                row = await c.fetchone()
+            row = await fetchone(
+                db,
+                SQL_GET_BALANCE, (interaction.user.id,)
+            )
             stell_bal = row["balance"] if row else 0
 
             async with db.execute(
@@ -3809,15 +4134,15 @@ class CestaSystem(commands.Cog):
 
     @app_commands.command(name="セスタデイリー", description="本日のセスタコインを受け取ります（1日1回）")
     async def cesta_daily(self, interaction: discord.Interaction):
-        today   = datetime.datetime.now().strftime("%Y-%m-%d")
+        today   = _day_tag(datetime.datetime.now())
         user_id = interaction.user.id
         daily_amt = await _cfg(self.bot, "cesta_daily")
 
         async with self.bot.get_db() as db:
-            async with db.execute(
+            row = await fetchone(
+                db,
                 "SELECT last_claim FROM cesta_daily_claims WHERE user_id = ?", (user_id,)
-            ) as c:
-                row = await c.fetchone()
+            )
 
             if row and row["last_claim"] == today:
                 return await interaction.response.send_message(
@@ -3848,59 +4173,48 @@ class CestaSystem(commands.Cog):
                 "❌ 1以上の数を指定してね。", ephemeral=True
             )
 
-        today   = datetime.datetime.now().strftime("%Y-%m-%d")
+        today   = _day_tag(datetime.datetime.now())
         user_id = interaction.user.id
         rate    = await _cfg(self.bot, "cesta_rate")
         buy_cap = await _cfg(self.bot, "cesta_daily_buy_cap")
         cost    = amount * rate
 
+        month_tag = _month_tag()
         async with self.bot.get_db() as db:
-            async with db.execute(
+            pr = await fetchone(
+                db,
                 "SELECT amount FROM cesta_daily_purchases WHERE user_id = ? AND date = ?",
                 (user_id, today)
-            ) as c:
-                pr = await c.fetchone()
-        today_bought = pr["amount"] if pr else 0
-
-        if today_bought + amount > buy_cap:
-            remaining = buy_cap - today_bought
-            return await interaction.response.send_message(
-                f"⚠️ 本日の購入上限は **{buy_cap} セスタ** です。\n"
-                f"今日あと **{remaining} セスタ** まで購入できます。",
-                ephemeral=True
             )
+            today_bought = pr["amount"] if pr else 0
 
-        async with self.bot.get_db() as db:
-            async with db.execute(
-                "SELECT balance FROM accounts WHERE user_id = ?", (user_id,)
-            ) as c:
-                sr = await c.fetchone()
-        stell_bal = sr["balance"] if sr else 0
+            if today_bought + amount > buy_cap:
+                remaining = buy_cap - today_bought
+                return await interaction.response.send_message(
+                    f"⚠️ 本日の購入上限は **{buy_cap} セスタ** です。\n"
+                    f"今日あと **{remaining} セスタ** まで購入できます。",
+                    ephemeral=True
+                )
 
-        if stell_bal < cost:
-            return await interaction.response.send_message(
-                f"❌ Stellが不足しています。\n"
-                f"必要: **{cost:,} Stell** / 所持: **{stell_bal:,} Stell**",
-                ephemeral=True
-            )
+            # 残高チェックと引き落としを1文で（同時購入でもマイナスにならない）
+            if not await try_debit(db, user_id, cost):
+                sr = await fetchone(db, SQL_GET_BALANCE, (user_id,))
+                stell_bal = sr["balance"] if sr else 0
+                # 0行更新でも書き込みトランザクションは開いているので、返信を待つ前に閉じる
+                await db.rollback()
+                return await interaction.response.send_message(
+                    f"❌ Stellが不足しています。\n"
+                    f"必要: **{cost:,} Stell** / 所持: **{stell_bal:,} Stell**",
+                    ephemeral=True
+                )
 
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
-        async with self.bot.get_db() as db:
-            await db.execute(
-                "UPDATE accounts SET balance = balance - ? WHERE user_id = ?",
-                (cost, user_id)
-            )
             await self.add_balance(db, user_id, amount)
             await db.execute("""
                 INSERT INTO cesta_daily_purchases (user_id, date, amount) VALUES (?, ?, ?)
                 ON CONFLICT(user_id, date) DO UPDATE SET amount = amount + excluded.amount
             """, (user_id, today, amount))
-            await db.execute("""
-                INSERT INTO transactions
-                    (sender_id, receiver_id, amount, type, description, month_tag)
-                VALUES (?, 0, ?, 'CESTA_BUY', ?, ?)
-            """, (user_id, cost, f"セスタ購入 {amount}セスタ", month_tag))
             await db.commit()
+        self.bot.db_manager.log_transaction(user_id, 0, cost, 'CESTA_BUY', f"セスタ購入 {amount}セスタ", month_tag)
 
         new_cesta = await self.get_balance(user_id)
         embed = discord.Embed(
@@ -3954,6 +4268,7 @@ class CestaSystem(commands.Cog):
                     (k, str(v))
                 )
             await db.commit()
+        _cfg_invalidate(*changed)
         lines = "\n".join(f"• **{k}** → `{v}`" for k, v in changed.items())
         await interaction.followup.send(f"✅ 設定を更新しました:\n{lines}", ephemeral=True)
 
@@ -4023,7 +4338,7 @@ class CestaSystem(commands.Cog):
 
     async def get_badges(self, user_id: int) -> list:
         """ユーザーの所持バッジ一覧を返す"""
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute(
                 "SELECT badge_id FROM cesta_badges WHERE user_id = ?", (user_id,)
             ) as c:
@@ -4031,7 +4346,7 @@ class CestaSystem(commands.Cog):
         return [r["badge_id"] for r in rows]
 
     async def has_badge(self, user_id: int, badge_id: str) -> bool:
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute(
                 "SELECT 1 FROM cesta_badges WHERE user_id = ? AND badge_id = ?",
                 (user_id, badge_id)
@@ -4043,7 +4358,7 @@ class CestaSystem(commands.Cog):
     async def check_badges(self, interaction: discord.Interaction):
         user_id = interaction.user.id
 
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute(
                 "SELECT total_spent FROM cesta_spent WHERE user_id = ?", (user_id,)
             ) as c:
@@ -4062,12 +4377,6 @@ class CestaSystem(commands.Cog):
 
         owned = {b["badge_id"]: b["granted_at"] for b in badges}
 
-        BADGE_EMOJI = {
-            "入場券":    "🎟️",
-            "道化師の証": "🃏",
-            "座長の印":  "🎪",
-        }
-
         embed = discord.Embed(
             title="🎪 サーカス バッジ",
             color=Color.CESTA
@@ -4322,7 +4631,7 @@ class CestaShop(commands.Cog):
             except Exception as e:
                 # ロール付与等に失敗したらロールバックしてセスタを返す
                 await db.rollback()
-                logger.error(f"CestaShop purchase error (user={user_id}, item={item_id}): {e}")
+                logger.error("CestaShop purchase error (user=%s, item=%s): %s", user_id, item_id, e)
                 return await interaction.followup.send(
                     "❌ 購入処理中にエラーが発生しました。セスタは消費されていません。\n"
                     "時間をおいて再度お試しください。",
@@ -4478,13 +4787,13 @@ class CestaShop(commands.Cog):
                 "SELECT name FROM cesta_shop_items WHERE item_id = ?", (item_id,)
             ) as c:
                 row = await c.fetchone()
+            if row:
+                await db.execute("DELETE FROM cesta_shop_items WHERE item_id = ?", (item_id,))
+                await db.commit()
         if not row:
             return await interaction.response.send_message(
                 "❌ 商品が見つかりません。", ephemeral=True
             )
-        async with self.bot.get_db() as db:
-            await db.execute("DELETE FROM cesta_shop_items WHERE item_id = ?", (item_id,))
-            await db.commit()
         await interaction.response.send_message(
             f"🗑️ **{row['name']}**（{item_id}）を削除しました。", ephemeral=True
         )
@@ -4565,23 +4874,24 @@ class CestaShop(commands.Cog):
 
         removed = []
         errors  = []
-        async with self.bot.get_db() as db:
-            for e in expired:
-                user = interaction.guild.get_member(e["user_id"])
-                if user and e["role_id"]:
-                    role = interaction.guild.get_role(int(e["role_id"]))
-                    if role:
-                        try:
-                            await user.remove_roles(role, reason="セスタショップ期限切れ")
-                            removed.append(f"{user.display_name} / {e['name']}")
-                        except Exception as ex:
-                            errors.append(f"{e['user_id']}: {ex}")
-                            continue
+        done    = []
+        for e in expired:
+            user = interaction.guild.get_member(e["user_id"])
+            if user and e["role_id"]:
+                role = interaction.guild.get_role(int(e["role_id"]))
+                if role:
+                    try:
+                        await user.remove_roles(role, reason="セスタショップ期限切れ")
+                        removed.append(f"{user.display_name} / {e['name']}")
+                    except Exception as ex:
+                        errors.append(f"{e['user_id']}: {ex}")
+                        continue
+            done.append((e["user_id"], e["item_id"]))
 
-                await db.execute(
-                    "DELETE FROM cesta_shop_subs WHERE user_id = ? AND item_id = ?",
-                    (e["user_id"], e["item_id"])
-                )
+        async with self.bot.get_db() as db:
+            await db.executemany(
+                "DELETE FROM cesta_shop_subs WHERE user_id = ? AND item_id = ?", done
+            )
             await db.commit()
 
         lines = "\n".join(f"🗑️ {r}" for r in removed) or "なし"
@@ -4591,14 +4901,6 @@ class CestaShop(commands.Cog):
             embed.add_field(name="エラー", value="\n".join(errors), inline=False)
         await interaction.followup.send(embed=embed, ephemeral=True)
 
-            
-        lines = "\n".join(f"🗑️ {r}" for r in removed) or "なし"
-        embed = discord.Embed(title="🗑️ 期限切れ処理完了", color=Color.CESTA)
-        embed.add_field(name=f"剥奪({len(removed)}件)", value=lines, inline=False)
-        if errors:
-            embed.add_field(name="エラー", value="\n".join(errors), inline=False)
-        await interaction.followup.send(embed=embed, ephemeral=True)
-
     # ── /セスタショップ_チケット使用 ──────────────────────
     @app_commands.command(name="セスタショップ_チケット使用", description="【管理者】ユーザーの商品券を使用済みにします")
     @app_commands.describe(ticket_id="チケットID（/セスタチケット確認 で確認）", user="対象ユーザー")
@@ -4773,13 +5075,6 @@ class HumanStockMarket(commands.Cog):
     def calculate_price(self, shares):
         return self.base_price + (shares * self.slope)
 
-    async def init_market_db(self):
-        async with self.bot.get_db() as db:
-            await db.execute("CREATE TABLE IF NOT EXISTS stock_issuers (user_id INTEGER PRIMARY KEY, total_shares INTEGER DEFAULT 0, is_listed INTEGER DEFAULT 1)")
-            await db.execute("CREATE TABLE IF NOT EXISTS stock_holdings (user_id INTEGER, issuer_id INTEGER, amount INTEGER, avg_cost REAL, PRIMARY KEY (user_id, issuer_id))")
-            await db.execute("CREATE TABLE IF NOT EXISTS market_config (key TEXT PRIMARY KEY, value TEXT)")
-            await db.commit()
-
     # ── 昇格・入れ替えシステム (2週間ごとのランキング集計) ──
     @tasks.loop(hours=1) # 1時間ごとにチェック
     async def promotion_cycle_task(self):
@@ -4917,14 +5212,14 @@ class HumanStockMarket(commands.Cog):
             bonus = int(subtotal * self.issuer_fee)
             total = subtotal + fee + bonus
 
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (buyer.id,)) as c:
+            async with db.execute(SQL_GET_BALANCE, (buyer.id,)) as c:
                 bal = await c.fetchone()
                 if not bal or bal['balance'] < total: return (f"❌ 資金不足 (必要: {total:,} S)", False)
 
             try:
                 # 資産移動
-                await db.execute("UPDATE accounts SET balance = balance - ? WHERE user_id = ?", (total, buyer.id))
-                await db.execute("UPDATE accounts SET balance = balance + ? WHERE user_id = ?", (bonus, target.id)) # 発行者へ還元
+                await db.execute(SQL_DEBIT, (total, buyer.id))
+                await db.execute(SQL_CREDIT, (bonus, target.id)) # 発行者へ還元
                 
                 # 保有データ更新
                 async with db.execute("SELECT amount, avg_cost FROM stock_holdings WHERE user_id = ? AND issuer_id = ?", (buyer.id, target.id)) as c:
@@ -4941,9 +5236,8 @@ class HumanStockMarket(commands.Cog):
                 # 発行数増加（これにより次の人の購入価格が上がる）
                 await db.execute("UPDATE stock_issuers SET total_shares = total_shares + ? WHERE user_id = ?", (amount, target.id))
                 
-                month = datetime.datetime.now().strftime("%Y-%m")
-                await db.execute("INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag) VALUES (?, ?, ?, 'STOCK_BUY', ?, ?)",
-                                 (buyer.id, 0, total, f"株購入: {target.display_name}", month))
+                month = _month_tag()
+                await db.execute(SQL_INSERT_TX, (buyer.id, 0, total, 'STOCK_BUY', f"株購入: {target.display_name}", month))
                 await db.commit()
                 return (f"✅ 購入成功: {target.display_name} x{amount}株 (単価: {unit_price:,} S)", True)
             except Exception as e:
@@ -4971,13 +5265,12 @@ class HumanStockMarket(commands.Cog):
                 if new_n == 0: await db.execute("DELETE FROM stock_holdings WHERE user_id = ? AND issuer_id = ?", (seller.id, target.id))
                 else: await db.execute("UPDATE stock_holdings SET amount = ? WHERE user_id = ? AND issuer_id = ?", (new_n, seller.id, target.id))
                 
-                await db.execute("UPDATE accounts SET balance = balance + ? WHERE user_id = ?", (revenue, seller.id))
+                await db.execute(SQL_CREDIT, (revenue, seller.id))
                 # 発行数を減らす（価格が下がる）
                 await db.execute("UPDATE stock_issuers SET total_shares = total_shares - ? WHERE user_id = ?", (amount, target.id))
                 
-                month = datetime.datetime.now().strftime("%Y-%m")
-                await db.execute("INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag) VALUES (0, ?, ?, 'STOCK_SELL', ?, ?)",
-                                 (seller.id, revenue, f"株売却: {target.display_name}", month))
+                month = _month_tag()
+                await db.execute(SQL_INSERT_TX, (0, seller.id, revenue, 'STOCK_SELL', f"株売却: {target.display_name}", month))
                 await db.commit()
                 return (f"📉 売却成功: {revenue:,} S 受取", True)
             except Exception as e:
@@ -5015,7 +5308,6 @@ class HumanStockMarket(commands.Cog):
 
     @app_commands.command(name="株_上場", description="自分の株を上場します（キャスト限定）")
     async def ipo(self, interaction):
-        await self.init_market_db()
         user = interaction.user
 
         # ロールチェック
@@ -5042,7 +5334,6 @@ class HumanStockMarket(commands.Cog):
 
     @app_commands.command(name="株_取引パネル", description="株の売買パネルを開きます")
     async def open_panel(self, interaction: discord.Interaction, target: discord.Member):
-        await self.init_market_db()
         view = StockControlView(self, target)
         embed = await view.update_embed(interaction)
         if embed: await interaction.response.send_message(embed=embed, view=view)
@@ -5050,11 +5341,10 @@ class HumanStockMarket(commands.Cog):
 
     @app_commands.command(name="株_ランキング", description="現在の株価ランキングと次回の審査日を表示します")
     async def ranking(self, interaction: discord.Interaction):
-        await self.init_market_db()
         await interaction.response.defer()
         
         next_date_str = "未定"
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute("SELECT user_id, total_shares FROM stock_issuers WHERE is_listed=1") as c: rows = await c.fetchall()
             async with db.execute("SELECT value FROM market_config WHERE key = 'next_promotion_date'") as c:
                 row = await c.fetchone()
@@ -5100,14 +5390,22 @@ class ServerStats(commands.Cog):
         self.daily_log_task.cancel()
 
     # ── ジニ係数計算 ──────────────────────────────────────
-    def _calc_gini(self, balances: list) -> float:
-        if not balances or sum(balances) == 0:
+    @staticmethod
+    def _gini_sorted(s: list) -> float:
+        """昇順に並んだ残高リストからジニ係数を出す（ここでは並べ替えない）"""
+        total = sum(s)
+        if not s or total == 0:
             return 0.0
-        s = sorted(balances)
         n = len(s)
-        total = sum(s)
         return (2 * sum((i + 1) * v for i, v in enumerate(s)) / (n * total)) - (n + 1) / n
 
+    def _calc_gini(self, balances: list) -> float:
+        return self._gini_sorted(sorted(balances))
+
+    def _sort_with_gini(self, balances: list) -> tuple:
+        s = sorted(balances)
+        return s, self._gini_sorted(s)
+
 # ── 市民の残高リストを取得 ─────────────────────────────
     async def _get_citizen_balances(self) -> list[int]:
         guild = self.bot.guilds[0]
@@ -5115,7 +5413,7 @@ class ServerStats(commands.Cog):
             await guild.chunk()
         member_map = {m.id: m for m in guild.members}
 
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute(
                 "SELECT value FROM server_config WHERE key = 'citizen_role_id'"
             ) as c:
@@ -5149,21 +5447,12 @@ class ServerStats(commands.Cog):
         try:
             balances = await self._get_citizen_balances()
             total    = sum(balances)
-            gini     = self._calc_gini(balances)
-            today    = datetime.datetime.now().strftime("%Y-%m-%d")
+            gini     = await asyncio.to_thread(self._calc_gini, balances)
+            today    = _day_tag(datetime.datetime.now())
 
             # セスタ総量
             async with self.bot.get_db() as db:
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS daily_stats (
-                        date          TEXT PRIMARY KEY,
-                        total_stell   INTEGER DEFAULT 0,
-                        total_cesta   INTEGER DEFAULT 0,
-                        gini          REAL    DEFAULT 0
-                    )
-                """)
-                async with db.execute("SELECT SUM(balance) FROM cesta_wallets") as c:
-                    row = await c.fetchone()
+                row = await fetchone(db, "SELECT SUM(balance) FROM cesta_wallets")
                 total_cesta = row[0] or 0
 
                 await db.execute("""
@@ -5172,7 +5461,7 @@ class ServerStats(commands.Cog):
                 """, (today, total, total_cesta, gini))
                 await db.commit()
         except Exception as e:
-            logger.error(f"Daily Log Error: {e}")
+            logger.error("Daily Log Error: %s", e)
 
     @daily_log_task.before_loop
     async def before_daily_log(self):
@@ -5187,21 +5476,20 @@ class ServerStats(commands.Cog):
         try:
             # 現在の市民残高
             balances = await self._get_citizen_balances()
-            balances.sort()
+            # ソートとジニ係数は口座数に比例して重いので、イベントループの外で計算
+            balances, gini = await asyncio.to_thread(self._sort_with_gini, balances)
             count       = len(balances)
             total_stell = sum(balances)
             avg         = total_stell // count if count else 0
             median      = balances[count // 2] if balances else 0
-            gini        = self._calc_gini(balances)
 
             # セスタ総量
             async with self.bot.get_db() as db:
-                async with db.execute("SELECT SUM(balance) FROM cesta_wallets") as c:
-                    row = await c.fetchone()
+                row = await fetchone(db, "SELECT SUM(balance) FROM cesta_wallets")
                 total_cesta = row[0] or 0
 
                 # 7日前のデータ
-                week_ago = (datetime.datetime.now() - datetime.timedelta(days=7)).strftime("%Y-%m-%d")
+                week_ago = _day_tag(datetime.datetime.now() - datetime.timedelta(days=7))
                 async with db.execute(
                     "SELECT total_stell, total_cesta, gini FROM daily_stats WHERE date <= ? ORDER BY date DESC LIMIT 1",
                     (week_ago,)
@@ -5209,26 +5497,28 @@ class ServerStats(commands.Cog):
                     old = await c.fetchone()
 
                 # 24時間の資金フロー（自然 vs 運営操作）
-                cutoff_24h = datetime.datetime.now() - datetime.timedelta(days=1)
-                natural_mint = natural_burn = op_add = op_remove = 0
-                op_add_count = op_remove_count = 0
-
-                async with db.execute(
-                    "SELECT sender_id, receiver_id, amount, type FROM transactions WHERE created_at > ?",
-                    (cutoff_24h,)
-                ) as c:
-                    async for row in c:
-                        s_id, r_id, amt, t_type = row["sender_id"], row["receiver_id"], row["amount"], row["type"]
-                        if t_type == "SYSTEM_ADD":
-                            op_add += amt
-                            op_add_count += 1
-                        elif t_type == "SYSTEM_REMOVE":
-                            op_remove += amt
-                            op_remove_count += 1
-                        elif s_id == 0:
-                            natural_mint += amt
-                        elif r_id == 0:
-                            natural_burn += amt
+                # created_at は CURRENT_TIMESTAMP(UTC) なので、比較もSQLite側のUTC時刻で行う
+                async with db.execute("""
+                    SELECT
+                        SUM(CASE WHEN type = 'SYSTEM_ADD'    THEN amount ELSE 0 END) AS op_add,
+                        SUM(CASE WHEN type = 'SYSTEM_ADD'    THEN 1      ELSE 0 END) AS op_add_count,
+                        SUM(CASE WHEN type = 'SYSTEM_REMOVE' THEN amount ELSE 0 END) AS op_remove,
+                        SUM(CASE WHEN type = 'SYSTEM_REMOVE' THEN 1      ELSE 0 END) AS op_remove_count,
+                        SUM(CASE WHEN type IN ('SYSTEM_ADD', 'SYSTEM_REMOVE') THEN 0
+                                 WHEN sender_id = 0 THEN amount ELSE 0 END) AS natural_mint,
+                        SUM(CASE WHEN type IN ('SYSTEM_ADD', 'SYSTEM_REMOVE') THEN 0
+                                 WHEN sender_id = 0 THEN 0
+                                 WHEN receiver_id = 0 THEN amount ELSE 0 END) AS natural_burn
+                    FROM transactions
+                    WHERE created_at > datetime('now', '-1 day')
+                """) as c:
+                    flow = await c.fetchone()
+                op_add          = flow["op_add"] or 0
+                op_add_count    = flow["op_add_count"] or 0
+                op_remove       = flow["op_remove"] or 0
+                op_remove_count = flow["op_remove_count"] or 0
+                natural_mint    = flow["natural_mint"] or 0
+                natural_burn    = flow["natural_burn"] or 0
 
             # ── ステータス判定 ──
             # インフレ・デフレ
@@ -5333,7 +5623,7 @@ class ServerStats(commands.Cog):
             await interaction.followup.send(embed=embed)
 
         except Exception as e:
-            logger.error(f"Economy Report Error: {e}")
+            logger.error("Economy Report Error: %s", e)
             traceback.print_exc()
             await interaction.followup.send(f"❌ レポート生成中にエラーが発生しました: {e}")
 
@@ -5401,30 +5691,20 @@ class ShopPurchaseView(discord.ui.View):
                     ephemeral=True
                 )
 
-        # ── 残高チェック ──
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT balance FROM accounts WHERE user_id = ?", (user.id,)) as c:
-                row = await c.fetchone()
-                balance = row['balance'] if row else 0
-
-        if balance < self.price:
-            return await interaction.followup.send(
-                f"❌ お金が足りません。\n(価格: {self.price:,} S / 所持金: {balance:,} S)",
-                ephemeral=True
-            )
-
-        # ── 購入処理 ──
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
+        # ── 購入処理（残高チェックと引き落としを同時に） ──
+        month_tag = _month_tag()
         try:
             async with self.bot.get_db() as db:
-                await db.execute(
-                    "UPDATE accounts SET balance = balance - ? WHERE user_id = ?",
-                    (self.price, user.id)
-                )
-                await db.execute(
-                    "INSERT INTO transactions (sender_id, receiver_id, amount, type, description, month_tag) VALUES (?, 0, ?, 'SHOP', ?, ?)",
-                    (user.id, self.price, f"購入: Shop({self.shop_id}) item({self.role_id})", month_tag)
-                )
+                if not await try_debit(db, user.id, self.price):
+                    async with db.execute(SQL_GET_BALANCE, (user.id,)) as c:
+                        row = await c.fetchone()
+                        balance = row['balance'] if row else 0
+                    # 0行更新でも書き込みトランザクションは開いているので、返信を待つ前に閉じる
+                    await db.rollback()
+                    return await interaction.followup.send(
+                        f"❌ お金が足りません。\n(価格: {self.price:,} S / 所持金: {balance:,} S)",
+                        ephemeral=True
+                    )
 
                 if self.item_type == "rental":
                     expiry_date = datetime.datetime.now() + datetime.timedelta(days=30)
@@ -5447,9 +5727,12 @@ class ShopPurchaseView(discord.ui.View):
                     )
 
                 await db.commit()
+            self.bot.db_manager.log_transaction(
+                user.id, 0, self.price, 'SHOP', f"購入: Shop({self.shop_id}) item({self.role_id})", month_tag
+            )
 
         except Exception as e:
-            await db.rollback()
+            # 未コミット分は接続の返却時にロールバックされる
             return await interaction.followup.send(f"❌ エラーが発生しました: {e}", ephemeral=True)
 
         # ── ロール付与 ──
@@ -5572,23 +5855,25 @@ class ShopSystem(commands.Cog):
             return
 
         guild = self.bot.guilds[0]
-        async with self.bot.get_db() as db:
-            for row in expired_rows:
-                member = guild.get_member(row['user_id'])
-                role = guild.get_role(row['role_id'])
-                if member and role and role in member.roles:
+        # Discord側の処理中は接続を借りない（書き込みロックを握ったままAPIを待たない）
+        for row in expired_rows:
+            member = guild.get_member(row['user_id'])
+            role = guild.get_role(row['role_id'])
+            if member and role and role in member.roles:
+                try:
+                    await member.remove_roles(role, reason="ショップ有効期限切れ")
                     try:
-                        await member.remove_roles(role, reason="ショップ有効期限切れ")
-                        try:
-                            await member.send(f"⏳ **有効期限切れ**\nロール **{role.name}** の有効期限（30日）が終了しました。")
-                        except:
-                            pass
+                        await member.send(f"⏳ **有効期限切れ**\nロール **{role.name}** の有効期限（30日）が終了しました。")
                     except:
                         pass
-                await db.execute(
-                    "DELETE FROM shop_subscriptions WHERE user_id = ? AND role_id = ?",
-                    (row['user_id'], row['role_id'])
-                )
+                except:
+                    pass
+
+        async with self.bot.get_db() as db:
+            await db.executemany(
+                "DELETE FROM shop_subscriptions WHERE user_id = ? AND role_id = ?",
+                [(row['user_id'], row['role_id']) for row in expired_rows]
+            )
             await db.commit()
 
     @check_subscription_expiry.before_loop
@@ -5858,13 +6143,7 @@ class AdminTools(commands.Cog):
         if not message.guild:
             return
 
-        log_ch_id = None
-        async with self.bot.get_db() as db:
-            async with db.execute("SELECT value FROM server_config WHERE key = 'delete_log_id'") as c:
-                row = await c.fetchone()
-                if row:
-                    log_ch_id = int(row['value'])
-
+        log_ch_id = self.bot.config.log_channel_ids.get('delete_log_id')
         if not log_ch_id:
             return
 
@@ -5895,7 +6174,7 @@ class AdminTools(commands.Cog):
         try:
             await channel.send(embed=embed)
         except Exception as e:
-            logger.error(f"Delete Log Send Error: {e}")
+            logger.error("Delete Log Send Error: %s", e)
 
 
     @app_commands.command(name="ギャンブル制限解除", description="【管理者】指定ユーザーまたはロールの今日のプレイ制限を解除します")
@@ -5918,7 +6197,7 @@ class AdminTools(commands.Cog):
         if target and role:
             return await interaction.followup.send("❌ ユーザーとロールは同時に指定できません。", ephemeral=True)
 
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        today = _day_tag(datetime.datetime.now())
         games = ["chinchiro", "blackjack"] if game == "all" else [game]
 
         # 対象メンバーリストを作成
@@ -6002,7 +6281,7 @@ async def _do_close_ticket(bot, interaction: discord.Interaction, ch: discord.Te
     try:
         await ch.delete(reason=f"チケットクローズ by {interaction.user}")
     except Exception as e:
-        logger.error(f"Ticket channel delete error: {e}")
+        logger.error("Ticket channel delete error: %s", e)
 
 
 class TicketCreateButton(discord.ui.Button):
@@ -6061,7 +6340,7 @@ class TicketCreateButton(discord.ui.Button):
                 category=category, overwrites=overwrites
             )
         except Exception as e:
-            logger.error(f"Ticket channel create error: {e}")
+            logger.error("Ticket channel create error: %s", e)
             return await interaction.followup.send("❌ チャンネル作成に失敗しました。", ephemeral=True)
 
         async with bot.get_db() as db:
@@ -6370,7 +6649,7 @@ class TicketSystem(commands.Cog):
         try:
             await channel.delete(reason=f"強制クローズ by {interaction.user}")
         except Exception as e:
-            logger.error(f"Force close delete error: {e}")
+            logger.error("Force close delete error: %s", e)
 
         await interaction.followup.send("✅ チケットを強制クローズしました。", ephemeral=True)
 class InterviewPanelView(discord.ui.View):
@@ -6408,7 +6687,7 @@ class InterviewPanelView(discord.ui.View):
             probation_role = interaction.guild.get_role(self.probation_role_id)
             new_role = interaction.guild.get_role(data['role_id'])
             bonus_amount = 30000
-            month_tag = datetime.datetime.now().strftime("%Y-%m")
+            month_tag = _month_tag()
 
             try:
                 # ロールの付け替え
@@ -6438,12 +6717,7 @@ class InterviewPanelView(discord.ui.View):
                 embed.add_field(name="祝金", value=f"**{bonus_amount:,} Stell**", inline=False)
                 embed.set_footer(text=f"担当面接官: {interaction.user.display_name}")
 
-                log_ch_id = None
-                async with self.bot.get_db() as db:
-                    async with db.execute("SELECT value FROM server_config WHERE key = 'interview_log_id'") as c:
-                        row = await c.fetchone()
-                        if row: log_ch_id = int(row['value'])
-                
+                log_ch_id = self.bot.config.log_channel_ids.get('interview_log_id')
                 if log_ch_id:
                     log_ch = self.bot.get_channel(log_ch_id)
                     if log_ch: await log_ch.send(embed=embed)
@@ -6451,7 +6725,7 @@ class InterviewPanelView(discord.ui.View):
                 await interaction.followup.send(f"✅ **{member.display_name}** を **{data['desc']}** ルートで処理し、祝金を付与しました。", ephemeral=True)
 
             except Exception as e:
-                logger.error(f"Interview Error: {e}")
+                logger.error("Interview Error: %s", e)
                 await interaction.followup.send(f"❌ 処理中にエラーが発生しました: {e}", ephemeral=True)
 
         return callback
@@ -6478,6 +6752,16 @@ class RankingSystem(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self._xp_cooldown: Dict[int, datetime.datetime] = {}  # {user_id: last_xp_time}
+        # 書き込み待ちの集計 {(user_id, month): count} / {user_id: [xp, messages]}
+        self._pending_msgs: Dict[tuple, int] = defaultdict(int)
+        self._pending_levels: Dict[int, list] = defaultdict(lambda: [0, 0])
+        if not self.flush_stats_task.is_running():
+            self.flush_stats_task.start()
+
+    async def cog_unload(self):
+        self.flush_stats_task.cancel()
+        # 終了時（bot.close はコグを外してから戻る）に貯まっている分を書き切る
+        await self.flush_stats()
 
     @staticmethod
     def calc_level(xp: int) -> int:
@@ -6514,7 +6798,7 @@ class RankingSystem(commands.Cog):
         if message.author.bot: return
         if not message.guild: return
         now = datetime.datetime.now()
-        month_tag = now.strftime("%Y-%m")
+        month_tag = _month_tag()
         user_id = message.author.id
 
         # イースターエッグ: 「釈迦」を含むメッセージに0.5%で👁️リアクション
@@ -6524,54 +6808,69 @@ class RankingSystem(commands.Cog):
             except Exception:
                 pass
 
+        # 月別メッセージカウント・XPはメモリに貯めて flush_stats_task でまとめて書く
+        self._pending_msgs[(user_id, month_tag)] += 1
+        pending = self._pending_levels[user_id]
+        pending[1] += 1
+        # XP加算（60秒クールダウン）
+        last = self._xp_cooldown.get(user_id)
+        if not last or (now - last).total_seconds() >= 60:
+            self._xp_cooldown[user_id] = now
+            pending[0] += random.randint(15, 25)
+
+    async def flush_stats(self):
+        """貯まったメッセージ数・XPを1トランザクションで書き込む"""
+        msgs, self._pending_msgs = self._pending_msgs, defaultdict(int)
+        levels, self._pending_levels = self._pending_levels, defaultdict(lambda: [0, 0])
+        if not msgs and not levels:
+            return
+
         try:
             async with self.bot.get_db() as db:
-                # 月別メッセージカウント
-                await db.execute(
-                    "INSERT OR IGNORE INTO message_stats (user_id, month, count) VALUES (?, ?, 0)",
-                    (user_id, month_tag)
-                )
-                await db.execute(
-                    "UPDATE message_stats SET count = count + 1 WHERE user_id = ? AND month = ?",
-                    (user_id, month_tag)
-                )
-                # XP加算（60秒クールダウン）
-                last = self._xp_cooldown.get(user_id)
-                if not last or (now - last).total_seconds() >= 60:
-                    self._xp_cooldown[user_id] = now
-                    xp_gain = random.randint(15, 25)
-                    await db.execute(
-                        "INSERT OR IGNORE INTO user_levels (user_id) VALUES (?)", (user_id,)
-                    )
-                    await db.execute(
-                        "UPDATE user_levels SET xp = xp + ?, total_messages = total_messages + 1 WHERE user_id = ?",
-                        (xp_gain, user_id)
-                    )
-                    async with db.execute("SELECT xp FROM user_levels WHERE user_id = ?", (user_id,)) as c:
-                        row = await c.fetchone()
-                    if row:
-                        new_level = self.calc_level(row['xp'])
-                        await db.execute("UPDATE user_levels SET level = ? WHERE user_id = ?", (new_level, user_id))
-                else:
-                    # クールダウン中でもメッセージ数は加算
-                    await db.execute(
-                        "INSERT OR IGNORE INTO user_levels (user_id) VALUES (?)", (user_id,)
-                    )
-                    await db.execute(
-                        "UPDATE user_levels SET total_messages = total_messages + 1 WHERE user_id = ?",
-                        (user_id,)
+                await db.executemany("""
+                    INSERT INTO message_stats (user_id, month, count) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id, month) DO UPDATE SET count = count + excluded.count
+                """, [(uid, month, cnt) for (uid, month), cnt in msgs.items()])
+                await db.executemany("""
+                    INSERT INTO user_levels (user_id, xp, total_messages) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        xp             = xp + excluded.xp,
+                        total_messages = total_messages + excluded.total_messages
+                """, [(uid, xp, cnt) for uid, (xp, cnt) in levels.items()])
+
+                # XPが増えた人だけレベルを再計算
+                xp_users = [uid for uid, (xp, _) in levels.items() if xp > 0]
+                if xp_users:
+                    placeholders = ",".join("?" * len(xp_users))
+                    async with db.execute(
+                        f"SELECT user_id, xp FROM user_levels WHERE user_id IN ({placeholders})", xp_users
+                    ) as c:
+                        rows = await c.fetchall()
+                    await db.executemany(
+                        "UPDATE user_levels SET level = ? WHERE user_id = ?",
+                        [(self.calc_level(r['xp']), r['user_id']) for r in rows]
                     )
                 await db.commit()
         except Exception as e:
-            logger.error(f"Message Stats Error: {e}")
+            logger.error("Message Stats Error: %s", e)
+            # 書けなかった分は次回に持ち越す
+            for key, cnt in msgs.items():
+                self._pending_msgs[key] += cnt
+            for uid, (xp, cnt) in levels.items():
+                self._pending_levels[uid][0] += xp
+                self._pending_levels[uid][1] += cnt
+
+    @tasks.loop(seconds=60)
+    async def flush_stats_task(self):
+        await self.flush_stats()
 
     @app_commands.command(name="ランク", description="自分のランクカードを表示します")
     async def rank(self, interaction: discord.Interaction):
         await interaction.response.defer()
         user = interaction.user
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
+        month_tag = _month_tag()
 
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             # レベルデータ
             async with db.execute("SELECT xp, level, total_vc_seconds, total_messages FROM user_levels WHERE user_id = ?", (user.id,)) as c:
                 lv_row = await c.fetchone()
@@ -6663,7 +6962,7 @@ class RankingSystem(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         user = interaction.user
 
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute(
                 "SELECT user_a, user_b, total_seconds, rank FROM bonds WHERE (user_a = ? OR user_b = ?) AND rank != '' AND rank != '__SELECT__' ORDER BY total_seconds DESC",
                 (user.id, user.id)
@@ -6693,9 +6992,9 @@ class RankingSystem(commands.Cog):
     async def message_ranking(self, interaction: discord.Interaction, top: int = 10):
         await interaction.response.defer()
         top = max(1, min(top, 25))
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
+        month_tag = _month_tag()
 
-        async with self.bot.get_db() as db:
+        async with self.bot.get_db(readonly=True) as db:
             async with db.execute(
                 "SELECT user_id, count FROM message_stats WHERE month = ? ORDER BY count DESC LIMIT ?",
                 (month_tag, top)
@@ -6838,7 +7137,7 @@ class InterviewSystem(commands.Cog):
 
         processed_members = []
         bonus_amount = 30000
-        month_tag = datetime.datetime.now().strftime("%Y-%m")
+        month_tag = _month_tag()
 
         # 対象者のロール付け替えと祝金付与
         async with self.bot.get_db() as db:
@@ -6863,7 +7162,7 @@ class InterviewSystem(commands.Cog):
                     
                     processed_members.append(member)
                 except Exception as e:
-                    logger.error(f"Interview Error: {e}")
+                    logger.error("Interview Error: %s", e)
             await db.commit()
 
         if not processed_members:
@@ -6937,7 +7236,7 @@ class InterviewSystem(commands.Cog):
             await interaction.followup.send(f"✅ {member.display_name} の評価を完了し、ロールを更新しました。", ephemeral=True)
 
         except Exception as e:
-            logger.error(f"Eval Error: {e}")
+            logger.error("Eval Error: %s", e)
             await interaction.followup.send("❌ ロールの変更中にエラーが発生しました。権限などを確認してください。", ephemeral=True)
 
 
@@ -6956,37 +7255,32 @@ class CestaBankBot(commands.Bot):
         )
         
         self.db_path = "stella_bank_v1.db"
-        self.db_manager = BankDatabase(self.db_path)
+        self.db_manager = BankDatabase(self.db_path, pool_size=8)  # 参照用は最大8本まで保持（起動時に2本開く）
         self.config = ConfigManager(self)
+        self._perm_cache: Dict[tuple, tuple] = {}
+        self._owner_id_set: frozenset = frozenset()  # setup_hook で埋める
 
-    @contextlib.asynccontextmanager
-    async def get_db(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            await db.execute("PRAGMA foreign_keys = ON")
-            await db.execute("PRAGMA busy_timeout = 5000")
-            yield db
+    def get_db(self, readonly: bool = False):
+        """プールの接続を借りる（async with で使う）。ラッパーを挟まず acquire をそのまま返す"""
+        return self.db_manager.acquire(readonly)
+
+    async def close(self):
+        # コグの後始末（集計の書き出しなど）は super().close() の中で走るので、DBはその後に閉じる
+        await super().close()
+        await self.db_manager.close()
 
     async def setup_hook(self):
         async with self.get_db() as db:
             await self.db_manager.setup(db)
-            # ジャックポット用
-            await db.execute("""CREATE TABLE IF NOT EXISTS jackpot_tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                ticket_id TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )""")
-            # 統計レポート用
-            await db.execute("""CREATE TABLE IF NOT EXISTS last_stats_report (
-                id INTEGER PRIMARY KEY, 
-                total_balance INTEGER, 
-                gini_val REAL, 
-                timestamp DATETIME
-            )""")
-            await db.commit()
         
         await self.config.reload()
+        await self.db_manager.warm_up()
+        self.db_manager.start_tx_writer()
+
+        # 権限チェックのたびに is_owner を待たないよう、オーナーIDを先に集めておく
+        app = await self.application_info()
+        owner_ids = {m.id for m in app.team.members} if app.team else {app.owner.id}
+        self._owner_id_set = frozenset(owner_ids | set(self.owner_ids or ()) | ({self.owner_id} if self.owner_id else set()))
         
         if 'VCPanel' in globals():
             self.add_view(VCPanel())
@@ -7024,7 +7318,9 @@ class CestaBankBot(commands.Bot):
         
         if not self.backup_db_task.is_running():
             self.backup_db_task.start()
-        
+        if not self.optimize_db_task.is_running():
+            self.optimize_db_task.start()
+
         await self.tree.sync()
         logger.info("StellaBank System: Setup complete and All Cogs Synced.")
 
@@ -7033,17 +7329,14 @@ class CestaBankBot(commands.Bot):
         指定されたキー（currency_log_id, salary_log_id 等）の設定を読み込み、
         対応するチャンネルへログを送信します。
         """
-        async with self.get_db() as db:
-            async with db.execute("SELECT value FROM server_config WHERE key = ?", (log_key,)) as c:
-                row = await c.fetchone()
-                if row:
-                    try:
-                        channel_id = int(row['value'])
-                        channel = self.get_channel(channel_id) or await self.fetch_channel(channel_id)
-                        if channel:
-                            await channel.send(embed=embed)
-                    except Exception as e:
-                        logger.error(f"Log Send Error ({log_key}): {e}")
+        channel_id = self.config.log_channel_ids.get(log_key)
+        if channel_id:
+            try:
+                channel = self.get_channel(channel_id) or await self.fetch_channel(channel_id)
+                if channel:
+                    await channel.send(embed=embed)
+            except Exception as e:
+                logger.error("Log Send Error (%s): %s", log_key, e)
 
     @tasks.loop(hours=24)
     async def backup_db_task(self):
@@ -7054,7 +7347,7 @@ class CestaBankBot(commands.Bot):
             async with self.get_db() as db:
                 await db.execute(f"VACUUM INTO '{backup_name}'")
             
-            logger.info(f"Auto Backup Success: {backup_name}")
+            logger.info("Auto Backup Success: %s", backup_name)
 
             # 2. 古いバックアップを削除 (最新3世代のみ残す)
             # "backup_*.db" に一致するファイルをすべて取得して、名前順(日付順)に並べる
@@ -7066,15 +7359,32 @@ class CestaBankBot(commands.Bot):
                 for old_bk in backups[:-3]:
                     try:
                         os.remove(old_bk) # ファイル削除
-                        logger.info(f"Deleted old backup: {old_bk}")
+                        logger.info("Deleted old backup: %s", old_bk)
                     except Exception as e:
-                        logger.error(f"Failed to delete {old_bk}: {e}")
+                        logger.error("Failed to delete %s: %s", old_bk, e)
+
+        except Exception as e:
+            logger.error("Backup Failure: %s", e)
 
+    @tasks.loop(minutes=15)
+    async def optimize_db_task(self):
+        # クエリ統計を元にSQLiteへ必要なANALYZEだけを走らせる
+        # あわせてWALを本体へ書き戻して切り詰め、自動チェックポイント時の遅延の山を小さくする
+        try:
+            async with self.get_db() as db:
+                await db.execute("PRAGMA optimize")
+                await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
         except Exception as e:
-            logger.error(f"Backup Failure: {e}")
+            logger.error("DB Optimize Failure: %s", e)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        # ロールが変わったユーザーの権限判定キャッシュを捨てる
+        if before.roles != after.roles:
+            for key in [k for k in self._perm_cache if k[0] == after.id]:
+                del self._perm_cache[key]
 
     async def on_ready(self):
-        logger.info(f"Logged in as {self.user} (ID: {self.user.id})")
+        logger.info("Logged in as %s (ID: %s)", self.user, self.user.id)
         logger.info("--- Stella Bank System Online ---")
         
 # ── 実行ブロック ──